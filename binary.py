@@ -2,35 +2,71 @@
 
 # binary.py
 
+import os
+import sys
 import math
+import mmap
+import struct
 import random
+import bisect
 import functools
+import itertools
+import collections
+from array import array
 
 def setBits(dest, bits, start, count):
     hi = dest & ((1 << start) - 1)
     lo = dest >> (start+count)
     return hi | (bits << start) | (lo << (start+count))
 
-def getOnes(a):
-    index = 0
-    while (a > 0):
-        if (a & 0x1):
-            yield index
-        index +=1
-        a >>= 1
+_byteBits = [tuple((b >> i) & 0x1 for i in range(8)) for b in range(256)]
+
+@functools.lru_cache(maxsize=None)
+def _runsOfOtherThan(byte):
+    """A compiled pattern for runs of bytes other than byte, built on first use"""
+    import re
+    return re.compile(b'[^\\x%02x]+' % byte)
+
+def _lowBytes(a, n):
+    """The low n bits of a as little endian bytes"""
+    return (a & ((1 << n) - 1)).to_bytes((n + 7) // 8, 'little')
+
+def _setPositions(data, runs, flip, n):
+    # the regular expression skips whole runs of empty bytes in C; only bytes with
+    # something to report are looked at in Python, a 64 bit word at a time
+    for run in runs.finditer(data):
+        end = run.end()
+        for offset in range(run.start(), end, 8):
+            word = int.from_bytes(data[offset:min(offset + 8, end)], 'little')
+            word ^= flip & ((1 << (8 * min(8, end - offset))) - 1)
+            base = 8 * offset
+            while word:
+                low = word & -word
+                index = base + low.bit_length() - 1
+                if index >= n:
+                    return
+                yield index
+                word ^= low
+
+def getOnes(a, n=None):
+    """Indices of the ones in a (in its low n bits, if given), in increasing order"""
+    if a <= 0 and n is None:
+        return iter(())
+    if n is None:
+        n = a.bit_length()
+    return _setPositions(_lowBytes(a, n), _runsOfOtherThan(0x00), 0, n)
+
+def getZeros(a, n):
+    """Indices of the zeros in the low n bits of a, in increasing order"""
+    return _setPositions(_lowBytes(a, n), _runsOfOtherThan(0xff), (1 << 64) - 1, n)
 
 def getBits(a, n):
-  while (n > 0):
-    yield a & 0x1
-    a >>= 1
-    n -= 1
+    if n <= 0:
+        return iter(())
+    return itertools.islice(itertools.chain.from_iterable(map(_byteBits.__getitem__, _lowBytes(a, n))), n)
 
 def getIndexedBits(a, n):
-  i = 0
-  while (i < n):
-    yield (i, a & 0x1)
-    a >>= 1
-    i += 1
+    return enumerate(getBits(a, n))
 
 def getBit(i, n):
     ii = i >> int(n)
@@ -47,17 +83,11 @@ def clearBit(i, n):
     return setBit(i, n, False)
 
 def bitStr(a, n, separationWidth = None, separationCharacter=' '):
-    s = ''.join([repr(num) for num in getBits(a,n)])[::-1]
+    s = format(a & ((1 << n) - 1), '0%db' % n) if n > 0 else ''
     if separationWidth is None:
         return s
-    t = ""
-    offset = -1 * separationWidth
-    while len(s) > 0:
-        t = s[offset:] + separationCharacter + t
-        s = s[:offset]
-    if (t[-1]==separationCharacter):
-        t = t[:-1]
-    return t
+    groups = [s[max(0, i - separationWidth):i] for i in range(len(s), 0, -separationWidth)]
+    return separationCharacter.join(reversed(groups))
 
 
 # algorithm explained well at http://compprog.wordpress.com/2007/11/06/binary-numbers-counting-bits/
@@ -70,34 +100,117 @@ def countSparseOnes(i):
 
 
 _onesParcelSize = 16
-_onesParcelMap = [countSparseOnes(i) for i in range(1 << _onesParcelSize)]
+_onesParcelMap = None  # built by _getOnesParcelMap on first use
 _onesParcelMask = (1 << _onesParcelSize) - 1
+_incrementedBytes = bytes((b + 1) & 0xFF for b in range(256))
+def _getOnesParcelMap():
+    global _onesParcelMap
+    if _onesParcelMap is None:
+        # the counts for 0..2**(k+1)-1 are those for 0..2**k-1 followed by each plus one
+        counts = b'\x00'
+        for _ in range(_onesParcelSize):
+            counts += counts.translate(_incrementedBytes)
+        _onesParcelMap = counts
+    return _onesParcelMap
+
 def countOnesByParcel(a):
-    global _onesParcelMap, _onesParcelSize, _onesParcelMask
+    onesParcelMap = _getOnesParcelMap()
     count = 0
     while a > 0:
         b = a & _onesParcelMask
-        count += _onesParcelMap[b]
+        count += onesParcelMap[b]
         a >>= _onesParcelSize
     return count
 
-_countOnesCache = {}
-def countOnes(a, useCache=False):
-  global _countOnesCache
-  if useCache:
+_hasBitCount = hasattr(int, 'bit_count')
+if _hasBitCount:
+  def countOnesNative(a):
+    """popcount by int.bit_count (Python 3.10 and later)"""
+    return a.bit_count()
+else:
+  def countOnesNative(a):
+    """popcount by counting the digits of bin(), still a single pass in C"""
+    return bin(a).count('1')
+
+class PopcountCache:
+  """A bounded least-recently-used map from values to their number of ones
+
+  Bounded both by entries (maxsize) and by the bits of the values kept as keys (maxBits),
+  so that a few huge values cannot hold gigabytes; a value of more than maxBits bits is
+  counted but not kept.
+  """
+  def __init__(self, maxsize=65536, maxBits=1 << 26):
+    self.maxsize = maxsize
+    self.maxBits = maxBits
+    self.counts = collections.OrderedDict()
+    self.bits = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def countOnes(self, a):
     try:
-      return _countOnesCache[a]
+      count = self.counts[a]
     except KeyError:
-      count = countOnesByParcel(a)
-      _countOnesCache[a] = count
+      self.misses += 1
+      count = countOnesNative(a)
+      bits = a.bit_length()
+      if self.maxsize > 0 and bits <= self.maxBits:
+        self.counts[a] = count
+        self.bits += bits
+        self._evict()
       return count
-  return countOnesByParcel(a)
+    self.hits += 1
+    self.counts.move_to_end(a)
+    return count
+
+  def _evict(self):
+    while len(self.counts) > self.maxsize or self.bits > self.maxBits:
+      (a, _) = self.counts.popitem(last=False)
+      self.bits -= a.bit_length()
+      self.evictions += 1
+
+  def resize(self, maxsize, maxBits=None):
+    self.maxsize = maxsize
+    if maxBits is not None:
+      self.maxBits = maxBits
+    self._evict()
+
+  def clear(self):
+    self.counts.clear()
+    self.bits = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def info(self):
+    return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'size': len(self.counts), 'maxsize': self.maxsize, 'bits': self.bits,
+            'maxBits': self.maxBits}
+
+_countOnesCache = PopcountCache()
+def countOnes(a, useCache=False):
+  """popcount of a; with useCache, and no int.bit_count, through a PopcountCache
+  (hashing a value costs about as much as bit_count counting it)"""
+  if useCache and not _hasBitCount:
+    return _countOnesCache.countOnes(a)
+  return countOnesNative(a)
+
+def countOnesCacheInfo():
+  """hits, misses, evictions, size, maxsize, bits and maxBits of the countOnes(useCache=True) cache"""
+  return _countOnesCache.info()
+
+def clearCountOnesCache():
+  _countOnesCache.clear()
+
+def setCountOnesCacheSize(maxsize, maxBits=None):
+  _countOnesCache.resize(maxsize, maxBits)
 
 def countZeros(a,n,useCache=False):
   return n-countOnes(a,useCache)
 
 def bitDistance(a, b):
-    return countOnesByParcel(a ^ b)
+    return countOnes(a ^ b)
 
 def highestOneIndexSlow(a):
   result = -1
@@ -107,19 +220,7 @@ def highestOneIndexSlow(a):
   return result
 
 def highestOneIndex(a):
-  if a==0:
-    return -1
-  n64 = 0
-  x = a >> 64
-  while x > 0:
-    n64 += 1
-    x >>= 64
-  n = 64 * n64
-  x = a >> (n+1)
-  while x > 0:
-    n += 1
-    x >>= 1
-  return n
+  return a.bit_length() - 1 if a > 0 else -1
 
 def invert(a, bitCount):
   return (~a) + (1 << bitCount)
@@ -141,11 +242,61 @@ def fromList(bitList):
     value += (int(bit) << i)
   return value
 
+def fromOnes(indices):
+  """Xor together 1 << i for each index; returns (value, highest index or -1)
+
+  Many indices are set in a bytearray and converted once, rather than each one
+  rebuilding the whole integer.
+  """
+  indices = [int(i) for i in indices]
+  if not indices:
+    return (0, -1)
+  if min(indices) < 0:
+    raise ValueError("negative bit index %d" % min(indices))
+  highest = max(indices)
+  if len(indices) < 64:
+    value = 0
+    for i in indices:
+      value ^= 1 << i
+    return (value, highest)
+  data = bytearray((highest >> 3) + 1)
+  for i in indices:
+    data[i >> 3] ^= 1 << (i & 7)
+  return (int.from_bytes(data, 'little'), highest)
+
+_reversedByteBits = bytes(int('{:08b}'.format(b)[::-1], 2) for b in range(256))
+
+def reverseBits(a, n):
+  """The low n bits of a in reverse order"""
+  if n <= 0:
+    return 0
+  byteCount = (n + 7) // 8
+  data = (a & ((1 << n) - 1)).to_bytes(byteCount, 'little')[::-1].translate(_reversedByteBits)
+  return int.from_bytes(data, 'little') >> (8 * byteCount - n)
+
+def gatherBits(a, indices):
+  """The bits of a at the positions of the range indices, packed from bit 0 up"""
+  n = len(indices)
+  if n == 0:
+    return 0
+  if indices.step == 1:
+    return (a >> indices.start) & ((1 << n) - 1)
+  lo = min(indices[0], indices[-1])
+  if indices.step == -1:
+    return reverseBits(a >> lo, n)
+  # strided: slice the rendered bit string, least significant bit first
+  span = max(indices[0], indices[-1]) - lo + 1
+  s = format((a >> lo) & ((1 << span) - 1), '0%db' % span)[::-1]
+  stop = indices.stop - lo
+  s = s[indices.start - lo:stop if stop >= 0 else None:indices.step]
+  return int(s[::-1], 2)
+
 class BitwiseData:
   """Encapsulates a binary value and its length"""
   DEFAULT_STRING_SEPARATION = None
   def __init__(self, count=None, value=0, msb_first=False):
     self.value = int(value)
+    self.rankSelect = None
     minBits = 1 + highestOneIndex(value)
     if (count is None):
       self.count = max(minBits,1)
@@ -176,10 +327,10 @@ class BitwiseData:
     return countZeros(self.value, self.count, useCache)
   def __getitem__(self, key):
     if isinstance(key, slice):
-      s = list(self)[key]
-      if len(s) < 1:
+      indices = range(self.count)[key]
+      if len(indices) < 1:
         raise ValueError("Cannot slice BinaryData to zero bits (%s)" % key)
-      return BitwiseData.createFromList(s)
+      return BitwiseData(len(indices), gatherBits(self.value, indices))
     if key < 0:
       key = self.count + key
     return getBit(self.value, key)
@@ -195,11 +346,8 @@ class BitwiseData:
   def withFlippedBit(self, b):
     return self.withValue(self.value ^ (1 << int(b)))
   def withFlips(self, bitsToFlip):
-    value = self.value
-    for b in bitsToFlip:
-      value ^= (1 << int(b))
-    count = max(self.count, max(bitsToFlip)+1)
-    return BitwiseData(count, value)
+    (flips, highest) = fromOnes(bitsToFlip)
+    return BitwiseData(max(self.count, highest + 1), self.value ^ flips)
 
   def bitStr(self, separationWidth = None, separationCharacter=' '):
     if separationWidth == None:
@@ -253,22 +401,14 @@ class BitwiseData:
   def __str__(self):
     return self.bitStr()
   def __iter__(self):
-    value = self.value
-    count = self.count
-    while count > 0:
-      yield value & 0x1
-      value >>= 1
-      count -= 1
-    return
+    return getBits(self.value, self.count)
   def __mul__(self, other):
     if type(other)==int:
       """Repeat a BD n times"""
-      n = other
-      v = 0 
-      for _ in range(n):
-        v <<= self.count
-        v += self.value
-      return BitwiseData(self.count * n, v)
+      builder = BitBuilder()
+      for _ in range(other):
+        builder.append(self.value, self.count)
+      return builder.freeze()
     raise TypeError(f"Unsupported operand type {type(other)}")
   def append(self, other):
     if type(other) != BitwiseData:
@@ -277,17 +417,25 @@ class BitwiseData:
     v = (other.value << self.count) + self.value
     return BitwiseData(c, v)
   def ones(self):
-    value = self.value
-    index = 0
-    while index < self.count:
-      if value & 0x1:
-        yield index
-      value >>= 1
-      index += 1
-    return
+    return getOnes(self.value, self.count)
   def zeros(self):
-    return (~self).ones()
+    return getZeros(self.value, self.count)
+  def withRankSelect(self):
+    """A copy of this value with a RankSelect directory attached, for fast nthOne/nthZero"""
+    bd = BitwiseData(self.count, self.value)
+    bd.rankSelect = RankSelect(bd)
+    return bd
+  def rank1(self, i):
+    """Number of ones below bit i"""
+    if self.rankSelect is not None:
+      return self.rankSelect.rank1(i)
+    return countOnes(self.value & ((1 << i) - 1))
+  def rank0(self, i):
+    """Number of zeros below bit i"""
+    return i - self.rank1(i)
   def nthOne(self, n, onesCount=None):
+    if self.rankSelect is not None:
+      return self.rankSelect.select1(n)
     if onesCount is None:
       onesCount = self.countOnes()
     g = self.ones()
@@ -296,6 +444,8 @@ class BitwiseData:
       n -= 1
     return i
   def nthZero(self, n, zeroCount=None):
+    if self.rankSelect is not None:
+      return self.rankSelect.select0(n)
     if zeroCount is None:
       zeroCount = self.countZeros()
     g = self.zeros()
@@ -316,17 +466,20 @@ class BitwiseData:
     return self.withSetBits(0, start, count)
   def withOnes(self, start, count):
     return self.withSetBits(invert(0, count), start, count)
+  def view(self, key=slice(None)):
+    """A lazy BitView of the bits selected by key"""
+    return BitView(self, key)
   def split(self, n):
-    return list([self[k:k+n] for k in range(0, self.count, n)])
+    # cut pieces from one bytes copy, so each piece costs its own length, not self.count
+    data = self.value.to_bytes((self.count + 7) // 8 + 1, 'little')
+    pieces = []
+    for k in range(0, self.count, n):
+      count = min(n, self.count - k)
+      chunk = int.from_bytes(data[k >> 3:((k + count) >> 3) + 1], 'little')
+      pieces.append(BitwiseData(count, (chunk >> (k & 7)) & ((1 << count) - 1)))
+    return pieces
   def getIndexedBits(self):
-    a = self.value
-    n = self.count
-    i = 0
-    while (i < n):
-      yield (i, a & 0x1)
-      a >>= 1
-      i += 1
-    return
+    return getIndexedBits(self.value, self.count)
   def substr(self, start, count):
     return BitwiseData(count,(self.value >> start) & ((1<<count)-1))
   def withRshift(self, n):
@@ -340,7 +493,7 @@ class BitwiseData:
   def correlate(self, other):
     return self.count - 2 * self.bitDistance(other)
   def reversed(self):
-    return BitwiseData.convert(reversed(self))
+    return BitwiseData(self.count, reverseBits(self.value, self.count))
   def appendedWith(self, appendage):
     appendage = BitwiseData.convert(appendage)
     original_count = self.count
@@ -350,7 +503,14 @@ class BitwiseData:
   @staticmethod
   def concat(a, b=None):
     if (b == None):
-      c = functools.reduce(BitwiseData.concat, a)
+      builder = BitBuilder()
+      pieces = 0
+      for piece in a:
+        builder.append(BitwiseData.convert(piece))
+        pieces += 1
+      if pieces == 0:
+        raise TypeError("concat of an empty sequence")
+      c = builder.freeze()
     else:
       c = a.appendedWith(b)
     return c
@@ -383,8 +543,1770 @@ class BitwiseData:
   def convertBytes(origin, msb_first = False):
     if type(origin) != bytes:
       raise NotImplementedError(f'convertBytes only works on type "bytes", not "{type(origin)}"')
-    bd_array = [BitwiseData(8, b, msb_first) for b in origin]
-    return BitwiseData.concat(bd_array)
+    return BitwiseData.fromBuffer(origin, msb_first)
+
+  @staticmethod
+  def fromBuffer(buffer, msb_first=False):
+    """Convert any bytes-like object (bytes, bytearray, memoryview, mmap), 8 bits per byte
+
+    Byte 0 supplies the lowest bits.  With msb_first each byte's high bit comes first.
+    """
+    with memoryview(buffer) as view:
+      with view.cast('B') as data:
+        if msb_first:
+          data = data.tobytes().translate(_reversedByteBits)
+        return BitwiseData(8 * len(data), int.from_bytes(data, 'little'))
+
+  @staticmethod
+  def fromFile(path, msb_first=False):
+    """Read a whole file through mmap, without copying it into Python objects first"""
+    with open(path, 'rb') as f:
+      if os.fstat(f.fileno()).st_size == 0:
+        return BitwiseData(0, 0)
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        return BitwiseData.fromBuffer(m, msb_first)
+
+  def _littleBytes(self):
+    """toBytes(), made once and kept on this value (for RankSelect, which reads it in place)"""
+    data = getattr(self, '_bytes', None)
+    if data is None:
+      data = self._bytes = self.value.to_bytes((self.count + 7) // 8, 'little')
+    return data
+
+  def toBytes(self, msb_first=False):
+    """The inverse of fromBuffer; the last byte is zero padded if count is not a multiple of 8"""
+    data = getattr(self, '_bytes', None)
+    if data is None:
+      data = self.value.to_bytes((self.count + 7) // 8, 'little')
+    if msb_first:
+      data = data.translate(_reversedByteBits)
+    return data
+
+  def writeTo(self, file, msb_first=False):
+    """Write toBytes() to a binary file object or a path"""
+    if isinstance(file, (str, bytes, os.PathLike)):
+      with open(file, 'wb') as f:
+        return f.write(self.toBytes(msb_first))
+    return file.write(self.toBytes(msb_first))
+
+class BitView:
+  """A lazy slice of a BitwiseData
+
+  Slicing a view only combines index ranges; bits are gathered when the view is
+  materialized (or compared, or iterated).
+  """
+  def __init__(self, source, key=slice(None)):
+    self.source = source
+    self.indices = range(source.count)[key]
+
+  def __len__(self):
+    return len(self.indices)
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      view = BitView(self.source)
+      view.indices = self.indices[key]
+      return view
+    return getBit(self.source.value, self.indices[key])
+
+  def __iter__(self):
+    return iter(self.materialize())
+
+  def materialize(self):
+    if len(self.indices) < 1:
+      raise ValueError("Cannot materialize an empty BitView")
+    return BitwiseData(len(self.indices), gatherBits(self.source.value, self.indices))
+
+  def __eq__(self, other):
+    if type(other) == BitView:
+      other = other.materialize()
+    return self.materialize() == other
+  def __ne__(self, other):
+    return not self.__eq__(other)
+  __hash__ = None
+
+  def __repr__(self):
+    return "BitView(%r, %r)" % (self.source, self.indices)
+
+
+class BitBuilder:
+  """A mutable bit sequence, grown at the high end and frozen into a BitwiseData
+
+  Whole bytes live in a bytearray and only the last few bits are held in a small
+  integer, so append costs time proportional to the bits appended rather than to the
+  length built so far.
+  """
+  def __init__(self):
+    self.buffer = bytearray()
+    self.tail = 0
+    self.tailCount = 0
+
+  def __len__(self):
+    return 8 * len(self.buffer) + self.tailCount
+
+  def append(self, bits, count=None):
+    """Append count bits (the low bits of an int, or a whole BitwiseData)"""
+    if type(bits) == BitwiseData:
+      if count is None:
+        count = bits.count
+      bits = bits.value
+    elif count is None:
+      count = max(1, bits.bit_length())
+    self.tail |= (bits & ((1 << count) - 1)) << self.tailCount
+    self.tailCount += count
+    if self.tailCount >= _wordBits:
+      byteCount = self.tailCount >> 3
+      self.buffer += (self.tail & ((1 << (8 * byteCount)) - 1)).to_bytes(byteCount, 'little')
+      self.tail >>= 8 * byteCount
+      self.tailCount -= 8 * byteCount
+    return self
+
+  def appendBytes(self, data, msb_first=False):
+    """Append 8 bits per byte; msb_first takes each byte's high bit first"""
+    if msb_first:
+      data = bytes(data).translate(_reversedByteBits)
+    if self.tailCount == 0:
+      self.buffer += data
+    else:
+      self.append(int.from_bytes(data, 'little'), 8 * len(data))
+    return self
+
+  def extend(self, bits):
+    """Append each item of an iterable of bits or BitwiseData"""
+    for bit in bits:
+      if type(bit) == BitwiseData:
+        self.append(bit)
+      else:
+        self.append(int(bit), 1)
+    return self
+
+  def _checkIndex(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError("bit %d out of range" % i)
+    return i
+
+  def __getitem__(self, i):
+    i = self._checkIndex(i)
+    if i < 8 * len(self.buffer):
+      return (self.buffer[i >> 3] >> (i & 7)) & 0x1
+    return (self.tail >> (i - 8 * len(self.buffer))) & 0x1
+
+  def set(self, i, b=True):
+    if not b:
+      return self.clear(i)
+    i = self._checkIndex(i)
+    if i < 8 * len(self.buffer):
+      self.buffer[i >> 3] |= 1 << (i & 7)
+    else:
+      self.tail |= 1 << (i - 8 * len(self.buffer))
+    return self
+
+  def clear(self, i):
+    i = self._checkIndex(i)
+    if i < 8 * len(self.buffer):
+      self.buffer[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+    else:
+      self.tail &= ~(1 << (i - 8 * len(self.buffer)))
+    return self
+
+  def flip(self, i):
+    i = self._checkIndex(i)
+    if i < 8 * len(self.buffer):
+      self.buffer[i >> 3] ^= 1 << (i & 7)
+    else:
+      self.tail ^= 1 << (i - 8 * len(self.buffer))
+    return self
+
+  def freeze(self):
+    value = int.from_bytes(self.buffer, 'little') | (self.tail << (8 * len(self.buffer)))
+    return BitwiseData(len(self), value)
+
+
+class BitReader:
+  """Reads bit fields from a binary stream (anything with read()) or a bytes-like buffer
+
+  With msb_first each byte is read from its high bit down and a field's first bit is
+  its most significant; otherwise bytes are read from bit 0 up and the first bit is the
+  least significant.  Only the bits of the field being read are held as an integer, so
+  memory stays constant however long the input is.
+  """
+  def __init__(self, source, msb_first=False, bufferSize=65536):
+    self.msb_first = msb_first
+    self.bufferSize = bufferSize
+    if hasattr(source, 'read'):
+      self.stream = source
+      self.chunk = b''
+    else:
+      self.stream = None
+      self.chunk = memoryview(source).cast('B')
+    self.offset = 0   # next unread byte of chunk
+    self.bits = 0     # bits taken from the input but not yet read
+    self.bitCount = 0
+    self.position = 0
+
+  def _nextBytes(self, byteCount):
+    if self.offset >= len(self.chunk):
+      if self.stream is None:
+        return b''
+      self.chunk = self.stream.read(max(self.bufferSize, byteCount))
+      self.offset = 0
+    data = self.chunk[self.offset:self.offset + byteCount]
+    self.offset += len(data)
+    return data
+
+  def _fill(self, nbits):
+    while self.bitCount < nbits:
+      data = self._nextBytes(max(_wordBytes, (nbits - self.bitCount + 7) // 8))
+      if len(data) == 0:
+        break
+      if self.msb_first:
+        self.bits = (self.bits << (8 * len(data))) | int.from_bytes(data, 'big')
+      else:
+        self.bits |= int.from_bytes(data, 'little') << self.bitCount
+      self.bitCount += 8 * len(data)
+    return self.bitCount >= nbits
+
+  def _field(self, nbits):
+    if self.msb_first:
+      return self.bits >> (self.bitCount - nbits)
+    return self.bits & ((1 << nbits) - 1)
+
+  def _result(self, value, nbits, bitwise):
+    if bitwise:
+      # bit 0 of the BitwiseData is the first bit read, as with fromBuffer
+      return BitwiseData(nbits, value, msb_first=self.msb_first)
+    return value
+
+  def peek(self, nbits, bitwise=False):
+    """The next nbits without consuming them"""
+    if not self._fill(nbits):
+      raise EOFError("%d bits requested, %d available" % (nbits, self.bitCount))
+    return self._result(self._field(nbits), nbits, bitwise)
+
+  def read(self, nbits, bitwise=False):
+    """Consume nbits, returned as an int (or as a BitwiseData when bitwise is set)"""
+    value = self.peek(nbits)
+    self.bitCount -= nbits
+    if self.msb_first:
+      self.bits &= (1 << self.bitCount) - 1
+    else:
+      self.bits >>= nbits
+    self.position += nbits
+    return self._result(value, nbits, bitwise)
+
+  def skip(self, nbits):
+    """Consume nbits without converting them; whole bytes are skipped in the input"""
+    dropped = min(nbits, self.bitCount)
+    self.read(dropped)
+    nbits -= dropped
+    while nbits >= 8:
+      data = self._nextBytes(nbits // 8)
+      if len(data) == 0:
+        raise EOFError("skipped past the end of the input")
+      nbits -= 8 * len(data)
+      self.position += 8 * len(data)
+    if nbits:
+      self.read(nbits)
+
+  def align(self):
+    """Skip to the next byte boundary"""
+    self.skip(-self.position % 8)
+
+  def tell(self):
+    """Number of bits consumed"""
+    return self.position
+
+class BitWriter:
+  """Writes bit fields to a binary stream (anything with write()), the counterpart of BitReader
+
+  Without a sink the bytes are collected and returned by getvalue().  Whole bytes are
+  moved out of the pending integer as soon as there are a word's worth, and handed to
+  the sink once bufferSize of them have built up.
+  """
+  def __init__(self, sink=None, msb_first=False, bufferSize=65536):
+    self.sink = sink
+    self.msb_first = msb_first
+    self.bufferSize = bufferSize
+    self.buffer = bytearray()
+    self.bits = 0
+    self.bitCount = 0
+    self.position = 0
+
+  def write(self, value, nbits=None):
+    """Append the low nbits of an int, or all of a BitwiseData (its bit 0 first)"""
+    if type(value) == BitwiseData:
+      if nbits is None:
+        nbits = value.count
+      value = reverseBits(value.value, nbits) if self.msb_first else value.value
+    elif nbits is None:
+      nbits = max(1, value.bit_length())
+    value &= (1 << nbits) - 1
+    if self.msb_first:
+      self.bits = (self.bits << nbits) | value
+    else:
+      self.bits |= value << self.bitCount
+    self.bitCount += nbits
+    self.position += nbits
+    if self.bitCount >= _wordBits:
+      self._emit()
+    return self
+
+  def _emit(self):
+    byteCount = self.bitCount // 8
+    rest = self.bitCount - 8 * byteCount
+    if self.msb_first:
+      self.buffer += (self.bits >> rest).to_bytes(byteCount, 'big')
+      self.bits &= (1 << rest) - 1
+    else:
+      self.buffer += (self.bits & ((1 << (8 * byteCount)) - 1)).to_bytes(byteCount, 'little')
+      self.bits >>= 8 * byteCount
+    self.bitCount = rest
+    if self.sink is not None and len(self.buffer) >= self.bufferSize:
+      self.sink.write(self.buffer)
+      self.buffer = bytearray()
+
+  def align(self):
+    """Pad with zeros to the next byte boundary"""
+    if self.bitCount % 8:
+      self.write(0, 8 - self.bitCount % 8)
+    return self
+
+  def flush(self):
+    """Pad to a byte boundary and pass everything written so far to the sink"""
+    self.align()
+    self._emit()
+    if self.sink is not None:
+      self.sink.write(self.buffer)
+      self.buffer = bytearray()
+      if hasattr(self.sink, 'flush'):
+        self.sink.flush()
+    return self
+
+  def getvalue(self):
+    """All bytes written, when there is no sink"""
+    self.flush()
+    return bytes(self.buffer)
+
+  def tell(self):
+    """Number of bits written"""
+    return self.position
+
+  def __enter__(self):
+    return self
+  def __exit__(self, *exc):
+    self.flush()
+
+
+def _bloomKey(item):
+  """The bytes hashed for an item: bytes-likes as they are, str as UTF-8, ints and
+  BitwiseData by value, each behind a type tag so that 1, b'\x01' and BitwiseData(8, 1)
+  are different keys (and BitwiseData of different counts too)"""
+  if isinstance(item, (bytes, bytearray, memoryview)):
+    return b'b' + bytes(item)
+  if isinstance(item, str):
+    return b's' + item.encode('utf-8')
+  if type(item) == BitwiseData:
+    return b'd' + item.count.to_bytes(8, 'little') + item.toBytes()
+  if isinstance(item, int):
+    return b'i' + item.to_bytes(item.bit_length() // 8 + 1, 'little', signed=True)
+  raise TypeError("cannot hash %s into a Bloom filter" % type(item).__name__)
+
+def _bloomDigests(items, seed, digestSize):
+  """A blake2b digest, as an int, of each item, salted with the filter seed"""
+  import hashlib
+  salt = seed.to_bytes(16, 'little')
+  blake2b = hashlib.blake2b
+  for item in items:
+    digest = blake2b(_bloomKey(item), digest_size=digestSize, salt=salt).digest()
+    yield int.from_bytes(digest, 'little')
+
+_bloomHeader = struct.Struct('<4sBBHQQ')  # magic, kind, hashCount, unused, seed, size
+_bloomMagic = b'BLMF'
+_bloomMask = (1 << 64) - 1
+
+class BloomFilter:
+  """A Bloom filter: set membership with no false negatives and a tunable false positive rate
+
+  Sized from the number of items expected and the false positive rate wanted, or given
+  bitCount and hashCount directly.  The bits live in one bytearray (bit i of the filter
+  is bit i % 8 of byte i // 8, the layout of BitwiseData.toBytes), set in place.  The
+  hashCount probe positions come from one salted blake2b digest per item by double
+  hashing, h1 + i * h2.  Filters with the same size, hashCount and seed can be combined.
+  """
+  KIND = 0
+
+  def __init__(self, capacity=None, errorRate=0.01, bitCount=None, hashCount=None, seed=0):
+    if bitCount is None:
+      if capacity is None:
+        raise ValueError("BloomFilter needs a capacity or a bitCount")
+      bitCount = math.ceil(-max(capacity, 1) * math.log(errorRate) / math.log(2) ** 2)
+    bitCount = self._roundSize(max(bitCount, 1))
+    if hashCount is None:
+      if capacity is None:
+        raise ValueError("BloomFilter needs a capacity or a hashCount")
+      hashCount = max(1, round(bitCount / max(capacity, 1) * math.log(2)))
+    if not 0 < hashCount < 256:
+      raise ValueError("hashCount %d is not in 1..255" % hashCount)
+    self.bitCount = bitCount
+    self.hashCount = hashCount
+    self.seed = seed
+    self.digestSize = 16
+    self.bits = bytearray(bitCount // 8)
+
+  @staticmethod
+  def _roundSize(bitCount):
+    return (bitCount + 7) & ~7
+
+  def _positions(self, digest):
+    (h1, h2) = (digest & _bloomMask, (digest >> 64) | 1)
+    return [(h1 + i * h2) % self.bitCount for i in range(self.hashCount)]
+
+  def add(self, item):
+    self.update((item,))
+
+  def update(self, items):
+    """Add many items"""
+    bits = self.bits
+    for digest in _bloomDigests(items, self.seed, self.digestSize):
+      for i in self._positions(digest):
+        bits[i >> 3] |= 1 << (i & 7)
+
+  def contains(self, items):
+    """A list of booleans, whether each item may be in the filter"""
+    bits = self.bits
+    return [all(bits[i >> 3] >> (i & 7) & 1 for i in self._positions(digest))
+            for digest in _bloomDigests(items, self.seed, self.digestSize)]
+
+  def __contains__(self, item):
+    return self.contains((item,))[0]
+
+  def countOnes(self):
+    return countOnes(int.from_bytes(self.bits, 'little'))
+
+  def estimatedCount(self):
+    """The number of distinct items added, estimated from the fraction of bits set"""
+    ones = self.countOnes()
+    if ones == self.bitCount:
+      return float('inf')
+    return -self.bitCount / self.hashCount * math.log1p(-ones / self.bitCount)
+
+  def falsePositiveRate(self):
+    """The chance that an item never added is reported present, at the current fill"""
+    return (self.countOnes() / self.bitCount) ** self.hashCount
+
+  def _check(self, other):
+    if (type(other) != type(self) or other.bitCount != self.bitCount
+        or other.hashCount != self.hashCount or other.seed != self.seed):
+      raise ValueError("filters differ in type, size, hashCount or seed")
+
+  def _withBits(self, value):
+    result = self.copy()
+    result.bits[:] = value.to_bytes(len(self.bits), 'little')
+    return result
+
+  def __or__(self, other):
+    """Union: contains everything either filter contains"""
+    self._check(other)
+    return self._withBits(int.from_bytes(self.bits, 'little') | int.from_bytes(other.bits, 'little'))
+
+  def __and__(self, other):
+    """Intersection: contains everything added to both (and more false positives than a
+    filter built from the common items)"""
+    self._check(other)
+    return self._withBits(int.from_bytes(self.bits, 'little') & int.from_bytes(other.bits, 'little'))
+
+  def __eq__(self, other):
+    return (type(other) == type(self) and other.bitCount == self.bitCount
+            and other.hashCount == self.hashCount and other.seed == self.seed and other.bits == self.bits)
+
+  def copy(self):
+    result = self.__class__(bitCount=self.bitCount, hashCount=self.hashCount, seed=self.seed)
+    result.bits[:] = self.bits
+    return result
+
+  def toBitwiseData(self):
+    return BitwiseData.fromBuffer(self.bits)
+
+  def toBytes(self):
+    """A 24 byte header followed by the filter bits; see BloomFilter.fromBytes"""
+    return _bloomHeader.pack(_bloomMagic, self.KIND, self.hashCount, 0, self.seed, self.bitCount) + self.bits
+
+  @staticmethod
+  def fromBytes(data):
+    """Rebuild a BloomFilter, BlockedBloomFilter or CountingBloomFilter from toBytes()"""
+    with memoryview(data) as view:
+      if len(view) < _bloomHeader.size:
+        raise ValueError("truncated Bloom filter header")
+      (magic, kind, hashCount, _, seed, size) = _bloomHeader.unpack_from(view)
+      if magic != _bloomMagic or kind >= len(_bloomKinds):
+        raise ValueError("not a serialized Bloom filter")
+      result = _bloomKinds[kind](bitCount=size, hashCount=hashCount, seed=seed)
+      payload = view[_bloomHeader.size:]
+      if len(payload) != len(result._buffer()):
+        raise ValueError("Bloom filter payload is %d bytes, expected %d"
+                         % (len(payload), len(result._buffer())))
+      result._buffer()[:] = payload
+      return result
+
+  def _buffer(self):
+    return self.bits
+
+
+class BlockedBloomFilter(BloomFilter):
+  """A Bloom filter whose probes for an item all land in one 512 bit block
+
+  One block is one 64 byte cache line, so a lookup touches one line of memory instead
+  of hashCount scattered ones.  Each probe takes its own 9 bits of the digest (double
+  hashing within so small a block repeats whole probe patterns between keys).  Keys
+  crowd unevenly into blocks, which raises the false positive rate, so the filter is
+  grown until the rate over a Poisson spread of keys per block meets the target.
+  """
+  KIND = 1
+  BLOCK_BITS = 512
+  MAX_HASH_COUNT = 49  # 9 bits of a 64 byte digest per probe, after 64 for the block
+
+  def __init__(self, capacity=None, errorRate=0.01, bitCount=None, hashCount=None, seed=0):
+    if bitCount is None and capacity is not None:
+      if hashCount is None:
+        hashCount = max(1, round(-math.log2(errorRate)))
+      bitCount = math.ceil(-max(capacity, 1) * math.log(errorRate) / math.log(2) ** 2)
+      while BlockedBloomFilter.expectedFalsePositiveRate(bitCount, capacity, hashCount) > errorRate:
+        bitCount = math.ceil(bitCount * 1.05)
+    BloomFilter.__init__(self, capacity, errorRate, bitCount, hashCount, seed)
+    if self.hashCount > BlockedBloomFilter.MAX_HASH_COUNT:
+      raise ValueError("BlockedBloomFilter hashCount %d is over %d"
+                       % (self.hashCount, BlockedBloomFilter.MAX_HASH_COUNT))
+    self.blockCount = self.bitCount // BlockedBloomFilter.BLOCK_BITS
+    self.digestSize = 8 + (9 * self.hashCount + 7) // 8
+
+  @staticmethod
+  def expectedFalsePositiveRate(bitCount, capacity, hashCount):
+    """False positive rate after capacity keys, averaged over keys per block"""
+    blockBits = BlockedBloomFilter.BLOCK_BITS
+    mean = max(capacity, 1) * blockBits / max(bitCount, blockBits)
+    (rate, p, j) = (0.0, math.exp(-mean), 0)
+    while j < mean + 10 * math.sqrt(mean) + 10:
+      rate += p * (1 - (1 - 1 / blockBits) ** (hashCount * j)) ** hashCount
+      j += 1
+      p *= mean / j
+    return rate
+
+  @staticmethod
+  def _roundSize(bitCount):
+    return -(-bitCount // BlockedBloomFilter.BLOCK_BITS) * BlockedBloomFilter.BLOCK_BITS
+
+  def _positions(self, digest):
+    base = (digest & _bloomMask) % self.blockCount * BlockedBloomFilter.BLOCK_BITS
+    digest >>= 64
+    return [base + ((digest >> (9 * i)) & 0x1ff) for i in range(self.hashCount)]
+
+
+_nonzeroDigits = bytes([0x30] + [0x31] * 255)  # counter -> b'0' or b'1'
+
+class CountingBloomFilter:
+  """A Bloom filter with a byte counter per position, so items can also be removed
+
+  Counters stop at 255 and a saturated counter is never decremented, which keeps
+  removal from introducing false negatives.  Union adds counters and intersection
+  takes their minimum.
+  """
+  KIND = 2
+  MAX_COUNT = 255
+
+  def __init__(self, capacity=None, errorRate=0.01, bitCount=None, hashCount=None, seed=0):
+    layout = BloomFilter(capacity, errorRate, bitCount, hashCount, seed)
+    self.bitCount = layout.bitCount
+    self.hashCount = layout.hashCount
+    self.seed = seed
+    self.digestSize = layout.digestSize
+    self.counters = bytearray(self.bitCount)
+
+  _positions = BloomFilter._positions
+  add = BloomFilter.add
+  __contains__ = BloomFilter.__contains__
+  _check = BloomFilter._check
+  estimatedCount = BloomFilter.estimatedCount
+  falsePositiveRate = BloomFilter.falsePositiveRate
+
+  def update(self, items):
+    counters = self.counters
+    for digest in _bloomDigests(items, self.seed, self.digestSize):
+      for i in self._positions(digest):
+        if counters[i] < CountingBloomFilter.MAX_COUNT:
+          counters[i] += 1
+
+  def discard(self, item):
+    """Remove one insertion of an item, returning False (and changing nothing) if the
+    item is certainly absent.  Removing an item that was never added corrupts the filter."""
+    counters = self.counters
+    positions = self._positions(next(_bloomDigests((item,), self.seed, self.digestSize)))
+    if not all(counters[i] for i in positions):
+      return False
+    for i in positions:
+      if counters[i] < CountingBloomFilter.MAX_COUNT:
+        counters[i] -= 1
+    return True
+
+  def contains(self, items):
+    counters = self.counters
+    return [all(counters[i] for i in self._positions(digest))
+            for digest in _bloomDigests(items, self.seed, self.digestSize)]
+
+  def countOnes(self):
+    """Number of nonzero counters"""
+    return len(self.counters) - self.counters.count(0)
+
+  def _withCounters(self, counters):
+    result = self.copy()
+    result.counters[:] = counters
+    return result
+
+  def __or__(self, other):
+    self._check(other)
+    limit = CountingBloomFilter.MAX_COUNT
+    return self._withCounters(bytes(min(a + b, limit) for (a, b) in zip(self.counters, other.counters)))
+
+  def __and__(self, other):
+    self._check(other)
+    return self._withCounters(bytes(map(min, self.counters, other.counters)))
+
+  def __eq__(self, other):
+    return (type(other) == type(self) and other.bitCount == self.bitCount
+            and other.hashCount == self.hashCount and other.seed == self.seed
+            and other.counters == self.counters)
+
+  def copy(self):
+    result = CountingBloomFilter(bitCount=self.bitCount, hashCount=self.hashCount, seed=self.seed)
+    result.counters[:] = self.counters
+    return result
+
+  def toBloomFilter(self):
+    """The plain filter of the positions with nonzero counters"""
+    result = BloomFilter(bitCount=self.bitCount, hashCount=self.hashCount, seed=self.seed)
+    value = int(self.counters.translate(_nonzeroDigits)[::-1], 2)
+    result.bits[:] = value.to_bytes(len(result.bits), 'little')
+    return result
+
+  def toBitwiseData(self):
+    return self.toBloomFilter().toBitwiseData()
+
+  def toBytes(self):
+    header = _bloomHeader.pack(_bloomMagic, self.KIND, self.hashCount, 0, self.seed, self.bitCount)
+    return header + self.counters
+
+  fromBytes = staticmethod(BloomFilter.fromBytes)
+
+  def _buffer(self):
+    return self.counters
+
+_bloomKinds = (BloomFilter, BlockedBloomFilter, CountingBloomFilter)
+
+
+_wordBits = 64
+_wordBytes = 8
+
+def _wordsToInt(words):
+  """Interpret an array('Q') as one little endian integer, word 0 lowest"""
+  if sys.byteorder != 'little':
+    words = array('Q', words)
+    words.byteswap()
+  return int.from_bytes(words, 'little')
+
+def _intToWords(value, wordCount):
+  """Split a non-negative integer into an array('Q') of wordCount words, word 0 lowest"""
+  words = array('Q')
+  words.frombytes(value.to_bytes(wordCount * _wordBytes, 'little'))
+  if sys.byteorder != 'little':
+    words.byteswap()
+  return words
+
+def _repeatedBytes(pattern, wordCount):
+  return int.from_bytes(pattern * wordCount, 'little')
+
+@functools.lru_cache(maxsize=16)
+def _popcountMasks(wordCount):
+  return (_repeatedBytes(b'\x55' * _wordBytes, wordCount),
+          _repeatedBytes(b'\x33' * _wordBytes, wordCount),
+          _repeatedBytes(b'\x0f' * _wordBytes, wordCount),
+          _repeatedBytes(b'\xff' + b'\x00' * (_wordBytes - 1), wordCount))
+
+def wordPopcounts(value, wordCount, wordsPerGroup=1):
+  """Count the ones in each 64 bit word of value, returned as an array('Q')
+
+  All words are counted at once with the parallel (SWAR) popcount, so the work is a
+  handful of operations on one big integer rather than one Python call per word.
+  With wordsPerGroup > 1 the counts of each run of wordsPerGroup words are summed.
+  """
+  if wordCount == 0:
+    return array('Q')
+  (m1, m2, m4, lowByte) = _popcountMasks(wordCount)
+  x = value - ((value >> 1) & m1)
+  x = (x & m2) + ((x >> 2) & m2)
+  x = (x + (x >> 4)) & m4
+  # fold the byte counts into the low byte of each word; the high bytes pick up
+  # counts from the neighbouring word but are masked off below
+  x += x >> 8
+  x += x >> 16
+  x += x >> 32
+  x &= lowByte
+  if wordsPerGroup == 1:
+    return _intToWords(x, wordCount)
+  if wordsPerGroup & (wordsPerGroup - 1) == 0:
+    # the same folding again, a word at a time, stays inside power of two groups
+    shift = _wordBits
+    while shift < _wordBits * wordsPerGroup:
+      x += x >> shift
+      shift <<= 1
+    return _intToWords(x, wordCount)[::wordsPerGroup]
+  counts = _intToWords(x, wordCount)
+  return array('Q', (sum(counts[i:i + wordsPerGroup]) for i in range(0, wordCount, wordsPerGroup)))
+
+class BitwiseArray:
+  """A packed sequence of equal width bit vectors, stored in one uint64 buffer
+
+  Row i occupies wordsPerRow consecutive words, least significant word first.  The
+  bitwise operators and countOnes/bitDistance work on the whole buffer at once.
+  """
+  def __init__(self, width, length=0, words=None):
+    if width < 1:
+      raise ValueError("BitwiseArray width must be positive, not %d" % width)
+    self.width = width
+    self.wordsPerRow = (width + _wordBits - 1) // _wordBits
+    if words is None:
+      words = array('Q', bytes(_wordBytes * self.wordsPerRow * length))
+    elif len(words) != self.wordsPerRow * length:
+      raise ValueError("%d words cannot hold %d rows of width %d" % (len(words), length, width))
+    self.words = words
+
+  def __len__(self):
+    return len(self.words) // self.wordsPerRow
+
+  def rowValue(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError("BitwiseArray row %d out of range" % i)
+    start = i * self.wordsPerRow
+    return _wordsToInt(self.words[start:start + self.wordsPerRow])
+
+  def rowValues(self):
+    """Every row as an int"""
+    data = self.value().to_bytes(_wordBytes * len(self.words), 'little')
+    rowBytes = _wordBytes * self.wordsPerRow
+    return [int.from_bytes(data[i:i + rowBytes], 'little') for i in range(0, len(data), rowBytes)]
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      rows = range(len(self))[key]
+      if rows.step == 1:
+        w = self.wordsPerRow
+        return BitwiseArray(self.width, len(rows), self.words[rows.start * w:rows.stop * w])
+      return BitwiseArray.createFromList([self[i] for i in rows], self.width)
+    return BitwiseData(self.width, self.rowValue(key))
+
+  def __setitem__(self, i, bitwiseData):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError("BitwiseArray row %d out of range" % i)
+    start = i * self.wordsPerRow
+    self.words[start:start + self.wordsPerRow] = _intToWords(self._rowInt(bitwiseData), self.wordsPerRow)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def append(self, bitwiseData):
+    self.words.extend(_intToWords(self._rowInt(bitwiseData), self.wordsPerRow))
+
+  def extend(self, bitwiseDataList):
+    for bitwiseData in bitwiseDataList:
+      self.append(bitwiseData)
+
+  def _rowInt(self, other):
+    value = other.value if type(other) == BitwiseData else int(other)
+    if value < 0 or value.bit_length() > self.width:
+      raise ValueError("value does not fit in a row of width %d" % self.width)
+    return value
+
+  def value(self):
+    """The whole buffer as one integer, row 0 in the lowest bits"""
+    return _wordsToInt(self.words)
+
+  def withValue(self, value):
+    return BitwiseArray(self.width, len(self), _intToWords(value, len(self.words)))
+
+  def _rowMask(self):
+    rowMask = (1 << self.width) - 1
+    return _repeatedBytes(rowMask.to_bytes(_wordBytes * self.wordsPerRow, 'little'), len(self))
+
+  def _operand(self, other):
+    """The big integer to combine with this buffer: another array, or one row broadcast to all"""
+    if type(other) == BitwiseArray:
+      if other.width != self.width or len(other) != len(self):
+        raise ValueError("BitwiseArray shapes differ: %dx%d and %dx%d"
+                         % (len(self), self.width, len(other), other.width))
+      return other.value()
+    row = self._rowInt(other)
+    return _repeatedBytes(row.to_bytes(_wordBytes * self.wordsPerRow, 'little'), len(self))
+
+  def __xor__(self, other):
+    return self.withValue(self.value() ^ self._operand(other))
+  def __and__(self, other):
+    return self.withValue(self.value() & self._operand(other))
+  def __or__(self, other):
+    return self.withValue(self.value() | self._operand(other))
+  def __invert__(self):
+    return self.withValue(self.value() ^ self._rowMask())
+
+  def __eq__(self, other):
+    if type(other) != BitwiseArray:
+      return False
+    return self.width == other.width and self.words == other.words
+  def __ne__(self, other):
+    return not self.__eq__(other)
+  __hash__ = None
+
+  def __repr__(self):
+    return "BitwiseArray(%d, %r)" % (self.width, self.toList())
+
+  def countOnes(self):
+    """Number of ones in each row, as an array('Q')"""
+    return wordPopcounts(self.value(), len(self.words), self.wordsPerRow)
+
+  def countZeros(self):
+    return array('Q', (self.width - c for c in self.countOnes()))
+
+  def bitDistance(self, other):
+    """Hamming distance of each row to the matching row of other (or to a single BitwiseData)"""
+    return wordPopcounts(self.value() ^ self._operand(other), len(self.words), self.wordsPerRow)
+
+  def toList(self):
+    return list(self)
+
+  @staticmethod
+  def createFromList(bitwiseDataList, width=None):
+    bitwiseDataList = [BitwiseData.convert(bd) for bd in bitwiseDataList]
+    if width is None:
+      width = max([bd.count for bd in bitwiseDataList] + [1])
+    result = BitwiseArray(width)
+    result.extend(bitwiseDataList)
+    return result
+
+  @staticmethod
+  def randomized(width, length, rng=random.getrandbits, p=None, precision=16):
+    """length random rows of width bits, drawn with a handful of calls to rng
+
+    Each bit is set with probability p (default 1/2).  A biased bit is built from
+    precision uniform bits by combining them with & or | according to the binary
+    digits of p, applied to the whole buffer at once.
+    """
+    result = BitwiseArray(width, length)
+    totalBits = _wordBits * len(result.words)
+    if totalBits == 0:
+      return result
+    if p is None:
+      return result.withValue(rng(totalBits) & result._rowMask())
+    if not 0 <= p <= 1:
+      raise ValueError("probability %r is not between 0 and 1" % p)
+    q = int(round(p * (1 << precision)))
+    if q >= 1 << precision:
+      return result.withValue(result._rowMask())
+    value = 0
+    for i in range((q & -q).bit_length() - 1 if q else precision, precision):
+      if (q >> i) & 0x1:
+        value |= rng(totalBits)
+      else:
+        value &= rng(totalBits)
+    return result.withValue(value & result._rowMask())
+
+  @staticmethod
+  def randomizedWithWeight(width, length, weight, rng=random.getrandbits):
+    """length random rows of width bits, each with exactly weight ones"""
+    if not 0 <= weight <= width:
+      raise ValueError("weight %d does not fit in width %d" % (weight, width))
+    result = BitwiseArray(width)
+    for _ in range(length):
+      # Floyd's algorithm: weight distinct positions with weight draws
+      chosen = set()
+      for j in range(width - weight, width):
+        t = randbelow(j + 1, rng)
+        chosen.add(j if t in chosen else t)
+      result.words.extend(_intToWords(fromOnes(chosen)[0], result.wordsPerRow))
+    return result
+
+def randbelow(n, rng=random.getrandbits):
+  """A uniform random int in [0, n) from a getrandbits-like rng"""
+  k = n.bit_length()
+  r = rng(k)
+  while r >= n:
+    r = rng(k)
+  return r
+
+def randomStream(seed, stream=0):
+  """A random.Random for one of many independent, reproducible streams of a seed
+
+  Parallel workers each take their own stream number; pass the result's getrandbits
+  as the rng of BitwiseArray.randomized.
+  """
+  import hashlib
+  digest = hashlib.sha512(repr((seed, stream)).encode()).digest()
+  return random.Random(int.from_bytes(digest, 'little'))
+
+
+def _packed(codes, width=None):
+  if type(codes) == BitwiseArray and (width is None or width == codes.width):
+    return codes
+  if type(codes) == BitwiseArray:
+    codes = codes.toList()
+  return BitwiseArray.createFromList(codes, width)
+
+def _pairTile(task):
+  """Distances (or correlations) between every row of one tile and every row of another
+
+  With a threshold only the matching (i, j, value) triples are returned, indexed from
+  rowStart and columnStart, so that the filtering happens in the worker and little has to
+  be sent back; aboveDiagonal keeps just the pairs with i < j.
+  """
+  (width, rowWords, columnWords, correlation, threshold, rowStart, columnStart, aboveDiagonal) = task
+  rows = BitwiseArray(width, len(rowWords) // ((width + _wordBits - 1) // _wordBits), rowWords)
+  columns = BitwiseArray(width, len(columnWords) // rows.wordsPerRow, columnWords)
+  rowBytes = _wordBytes * rows.wordsPerRow
+  if _hasBitCount:
+    columnValues = columns.rowValues()
+  else:
+    columnValue = columns.value()
+  tile = []
+  for (k, row) in enumerate(rows.rowValues()):
+    if _hasBitCount:
+      # a native popcount per pair beats whole-tile SWAR arithmetic
+      distances = array('Q', [(row ^ column).bit_count() for column in columnValues])
+    else:
+      broadcast = _repeatedBytes(row.to_bytes(rowBytes, 'little'), len(columns))
+      distances = wordPopcounts(columnValue ^ broadcast, len(columns.words), columns.wordsPerRow)
+    if correlation:
+      distances = array('q', (width - 2 * d for d in distances))
+    if threshold is None:
+      tile.append(distances)
+      continue
+    i = rowStart + k
+    first = max(0, i + 1 - columnStart) if aboveDiagonal else 0
+    if correlation:
+      tile.extend((i, columnStart + jj, value) for (jj, value) in enumerate(distances)
+                  if value >= threshold and jj >= first)
+    else:
+      tile.extend((i, columnStart + jj, value) for (jj, value) in enumerate(distances)
+                  if value <= threshold and jj >= first)
+  return tile
+
+def _mapTiles(tasks, processes):
+  """_pairTile over tasks, in order, on a pool of processes with a bounded backlog"""
+  if processes is None:
+    processes = os.cpu_count() or 1
+  if processes <= 1:
+    for task in tasks:
+      yield _pairTile(task)
+    return
+  import concurrent.futures
+  with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+    pending = collections.deque()
+    for task in tasks:
+      pending.append(pool.submit(_pairTile, task))
+      if len(pending) >= 2 * processes:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+
+def _pairTasks(a, b, correlation, tileSize, threshold=None):
+  """The (rowStart, columnStart) blocks to compare and the _pairTile task of each"""
+  if b is None:
+    a = _packed(a)
+    b = a
+    symmetric = True
+  else:
+    width = max(a.width if type(a) == BitwiseArray else max(bd.count for bd in a),
+                b.width if type(b) == BitwiseArray else max(bd.count for bd in b))
+    a = _packed(a, width)
+    b = _packed(b, width)
+    symmetric = False
+  w = a.wordsPerRow
+  blocks = [(i, j) for i in range(0, len(a), tileSize) for j in range(0, len(b), tileSize)
+            if not symmetric or j + tileSize > i]
+  tasks = ((a.width, a.words[i * w:(i + tileSize) * w], b.words[j * w:(j + tileSize) * w], correlation,
+            threshold, i, j, symmetric) for (i, j) in blocks)
+  return (blocks, tasks)
+
+def pairBlocks(a, b=None, correlation=False, tileSize=1024, processes=None):
+  """Yield (rowStart, columnStart, tile) blocks of the bitDistance (or correlate) matrix
+
+  tile[i][j] is the value for a[rowStart + i] and b[columnStart + j], each row of the
+  tile an array.  Without b, a is compared with itself and only the blocks on or above
+  the diagonal are produced.  Codes are packed into BitwiseArrays of one common width,
+  which is also the width correlations are measured against.  Blocks are computed on a
+  pool of processes (all cores by default, processes=1 to stay in this process) and
+  yielded in order, so the whole matrix never has to be held at once.
+  """
+  (blocks, tasks) = _pairTasks(a, b, correlation, tileSize)
+  for ((i, j), tile) in zip(blocks, _mapTiles(tasks, processes)):
+    yield (i, j, tile)
+
+def pairMatrix(a, b=None, correlation=False, upper=False, tileSize=1024, processes=None):
+  """The bitDistance (or correlate) matrix as a list of typed array rows
+
+  Without b, a is compared with itself; with upper set, row i then only holds the
+  values for columns i+1 onwards.
+  """
+  if upper and b is not None:
+    raise ValueError("upper only applies when comparing one collection with itself")
+  n = len(a)
+  m = n if b is None else len(b)
+  typecode = 'q' if correlation else 'Q'
+  rows = [array(typecode, bytes(8 * (m - i - 1 if upper else m))) for i in range(n)]
+  for (i0, j0, tile) in pairBlocks(a, b, correlation, tileSize, processes):
+    for (k, values) in enumerate(tile):
+      i = i0 + k
+      if upper:
+        start = max(j0, i + 1)
+        rows[i][start - i - 1:j0 + len(values) - i - 1] = values[start - j0:]
+      else:
+        rows[i][j0:j0 + len(values)] = values
+    if b is None and not upper and j0 != i0:
+      # the mirrored block below the diagonal, a tile column per row
+      for (jj, column) in enumerate(zip(*tile)):
+        rows[j0 + jj][i0:i0 + len(tile)] = array(typecode, column)
+  return rows
+
+def pairsWithin(a, threshold, b=None, correlation=False, tileSize=1024, processes=None):
+  """Sorted (i, j, value) for the pairs with bitDistance <= threshold (or correlate >= threshold)
+
+  Without b, a is compared with itself and each pair is listed once, with i < j.  The
+  filtering is done by the workers, which send back only the pairs found.
+  """
+  (blocks, tasks) = _pairTasks(a, b, correlation, tileSize, threshold)
+  pairs = []
+  for found in _mapTiles(tasks, processes):
+    pairs.extend(found)
+  pairs.sort()
+  return pairs
+
+
+class BitMatrix:
+  """A matrix over GF(2), each row packed into one integer (column j in bit j)
+
+  Adding one row to another is a single big integer xor, so row operations are done a
+  machine word at a time in C.  Elimination and multiplication use the Method of Four
+  Russians: for each block of k columns a table of all 2**k combinations of the
+  relevant rows is built once, and every other row then needs one lookup and one xor
+  for the whole block instead of up to k.
+  """
+  TRANSPOSE_STRIPE = 1024
+
+  def __init__(self, rowCount, columnCount, rows=None):
+    self.rowCount = rowCount
+    self.columnCount = columnCount
+    if rows is None:
+      rows = [0] * rowCount
+    elif len(rows) != rowCount:
+      raise ValueError("%d rows given for a matrix of %d rows" % (len(rows), rowCount))
+    self.rows = list(rows)
+
+  @staticmethod
+  def fromRows(rows, columnCount=None):
+    """A matrix whose rows are the given BitwiseData (or ints)"""
+    values = [row.value if type(row) == BitwiseData else int(row) for row in rows]
+    if columnCount is None:
+      columnCount = max([row.count if type(row) == BitwiseData else max(1, row.bit_length())
+                         for row in rows] + [0])
+    if any(v.bit_length() > columnCount for v in values):
+      raise ValueError("a row does not fit in %d columns" % columnCount)
+    return BitMatrix(len(values), columnCount, values)
+
+  @staticmethod
+  def identity(n):
+    return BitMatrix(n, n, [1 << i for i in range(n)])
+
+  @staticmethod
+  def randomized(rowCount, columnCount, rng=random.getrandbits):
+    return BitMatrix(rowCount, columnCount, [rng(columnCount) if columnCount else 0 for _ in range(rowCount)])
+
+  def __getitem__(self, key):
+    if isinstance(key, tuple):
+      (i, j) = key
+      return getBit(self.rows[i], j)
+    return BitwiseData(self.columnCount, self.rows[key])
+
+  def __setitem__(self, key, value):
+    if isinstance(key, tuple):
+      (i, j) = key
+      self.rows[i] = setBit(self.rows[i], j, value)
+    else:
+      value = value.value if type(value) == BitwiseData else int(value)
+      if value.bit_length() > self.columnCount:
+        raise ValueError("row does not fit in %d columns" % self.columnCount)
+      self.rows[key] = value
+
+  def toRows(self):
+    return [BitwiseData(self.columnCount, row) for row in self.rows]
+
+  def __eq__(self, other):
+    if type(other) != BitMatrix:
+      return False
+    return (self.rowCount, self.columnCount, self.rows) == (other.rowCount, other.columnCount, other.rows)
+  def __ne__(self, other):
+    return not self.__eq__(other)
+  __hash__ = None
+
+  def __repr__(self):
+    return "BitMatrix(%d, %d, [%s])" % (self.rowCount, self.columnCount,
+      ", ".join(bitStr(row, self.columnCount) for row in self.rows))
+
+  def __xor__(self, other):
+    if (self.rowCount, self.columnCount) != (other.rowCount, other.columnCount):
+      raise ValueError("cannot add %dx%d and %dx%d matrices"
+                       % (self.rowCount, self.columnCount, other.rowCount, other.columnCount))
+    return BitMatrix(self.rowCount, self.columnCount, [a ^ b for (a, b) in zip(self.rows, other.rows)])
+  __add__ = __xor__
+
+  def transpose(self):
+    """The transpose, gathered from each stripe of rows rendered as one bit string"""
+    columns = [[] for _ in range(self.columnCount)]
+    if self.columnCount:
+      form = '0%db' % self.columnCount
+      for start in range(0, self.rowCount, BitMatrix.TRANSPOSE_STRIPE):
+        stripeRows = self.rows[start:start + BitMatrix.TRANSPOSE_STRIPE]
+        stripe = ''.join(format(row, form)[::-1] for row in stripeRows)
+        for (j, column) in enumerate(columns):
+          column.append(stripe[j::self.columnCount])
+    rows = [int(''.join(column)[::-1] or '0', 2) for column in columns]
+    return BitMatrix(self.columnCount, self.rowCount, rows)
+
+  @staticmethod
+  def _blockSize(n):
+    return max(1, min(10, int(0.75 * math.log2(max(n, 2)))))
+
+  def __mul__(self, other):
+    """Matrix product, or the product with a column vector given as a BitwiseData"""
+    if type(other) != BitMatrix:
+      x = other.value if type(other) == BitwiseData else int(other)
+      return BitwiseData(self.rowCount, fromList([countOnes(row & x) & 0x1 for row in self.rows]))
+    if self.columnCount != other.rowCount:
+      raise ValueError("cannot multiply %dx%d by %dx%d"
+                       % (self.rowCount, self.columnCount, other.rowCount, other.columnCount))
+    # blocks of 8 columns of self, so each row's window is simply one of its bytes
+    rowBytes = [row.to_bytes((self.columnCount + 7) // 8, 'little') for row in self.rows]
+    product = [0] * self.rowCount
+    for (block, start) in enumerate(range(0, self.columnCount, 8)):
+      table = [0] * 256
+      for k in range(min(8, self.columnCount - start)):
+        row = other.rows[start + k]
+        step = 1 << k
+        for w in range(step):
+          table[step + w] = table[w] ^ row
+      for (i, data) in enumerate(rowBytes):
+        w = data[block]
+        if w:
+          product[i] ^= table[w]
+    return BitMatrix(self.rowCount, other.columnCount, product)
+
+  def echelon(self, k=None, reduced=True):
+    """(row echelon form, list of pivot columns)
+
+    The form is fully reduced (each pivot column zero outside its pivot row) unless
+    reduced is False; then only the rows below each pivot are cleared, which is about
+    half the work and enough for rank and solve.
+    """
+    rows = list(self.rows)
+    if k is None:
+      k = BitMatrix._blockSize(min(self.rowCount, self.columnCount))
+    pivots = []
+    r = 0
+    for c in range(0, self.columnCount, k):
+      if r >= len(rows):
+        break
+      blockEnd = min(c + k, self.columnCount)
+      blockPivots = []  # (column, row index); pivot rows are kept reduced against each other
+      for col in range(c, blockEnd):
+        bit = 1 << col
+        p = r + len(blockPivots)
+        found = None
+        for i in range(p, len(rows)):
+          v = rows[i]
+          for (pc, pi) in blockPivots:
+            if (v >> pc) & 0x1:
+              v ^= rows[pi]
+          rows[i] = v
+          if v & bit:
+            found = i
+            break
+        if found is None:
+          continue
+        (rows[p], rows[found]) = (rows[found], rows[p])
+        for (pc, pi) in blockPivots:
+          if rows[pi] & bit:
+            rows[pi] ^= rows[p]
+        blockPivots.append((col, p))
+      if not blockPivots:
+        continue
+      # Four Russians table: for each window of the block's bits, the pivot rows that clear it
+      width = blockEnd - c
+      pivotRows = {pc - c: rows[pi] for (pc, pi) in blockPivots}
+      table = [0] * (1 << width)
+      for w in range(1, 1 << width):
+        low = w & -w
+        table[w] = table[w ^ low] ^ pivotRows.get(low.bit_length() - 1, 0)
+      mask = (1 << width) - 1
+      below = r + len(blockPivots)
+      for i in itertools.chain(range(r) if reduced else (), range(below, len(rows))):
+        w = (rows[i] >> c) & mask
+        if w:
+          rows[i] ^= table[w]
+      pivots.extend(pc for (pc, _) in blockPivots)
+      r += len(blockPivots)
+    return (BitMatrix(self.rowCount, self.columnCount, rows), pivots)
+
+  def rank(self):
+    return len(self.echelon(reduced=False)[1])
+
+  def nullspace(self):
+    """A basis of {x : self * x == 0}, as BitwiseData"""
+    (reduced, pivots) = self.echelon()
+    pivotSet = set(pivots)
+    basis = []
+    for free in range(self.columnCount):
+      if free in pivotSet:
+        continue
+      x = 1 << free
+      for (t, p) in enumerate(pivots):
+        if (reduced.rows[t] >> free) & 0x1:
+          x |= 1 << p
+      basis.append(BitwiseData(self.columnCount, x))
+    return basis
+
+  def solve(self, b):
+    """One x (free variables zero) with self * x == b; ValueError if there is none"""
+    b = b.value if type(b) == BitwiseData else int(b)
+    n = self.columnCount
+    bits = getBits(b, self.rowCount)
+    augmented = BitMatrix(self.rowCount, n + 1, [row | (bit << n) for (row, bit) in zip(self.rows, bits)])
+    (echelon, pivots) = augmented.echelon(reduced=False)
+    if pivots and pivots[-1] == n:
+      raise ValueError("the system has no solution")
+    # back substitution: a pivot row only reaches into the columns of later pivots
+    x = 0
+    for t in reversed(range(len(pivots))):
+      row = echelon.rows[t]
+      if ((row >> n) ^ countOnes(row & x)) & 0x1:
+        x |= 1 << pivots[t]
+    return BitwiseData(n, x)
+
+
+class RankSelect:
+  """Rank/select directory over the bits of a BitwiseData
+
+  The directory itself is a cumulative count of the ones before each block of BLOCK_BITS
+  (one word per block, about 3% of the bits) and a block number for every SAMPLE_RATE'th
+  one and zero (under 1% more).  The bits are read from the little endian bytes that the
+  BitwiseData makes once and keeps (see BitwiseData._littleBytes, also shared by toBytes),
+  since a Python int cannot be sliced without copying all of it.  rank reads one count and
+  popcounts at most one block.  select binary searches the blocks between the samples on
+  either side, about log2(4 / density) steps for the density of the kind of bit sought,
+  and then scans words within the block.
+  """
+  BLOCK_BITS = 2048
+  SAMPLE_RATE = 8192
+
+  def __init__(self, bitwiseData):
+    self.count = bitwiseData.count
+    blockCount = (self.count + RankSelect.BLOCK_BITS - 1) // RankSelect.BLOCK_BITS
+    wordsPerBlock = RankSelect.BLOCK_BITS // _wordBits
+    self.data = bitwiseData._littleBytes()
+    blockCounts = wordPopcounts(bitwiseData.value, blockCount * wordsPerBlock, wordsPerBlock)
+    self.before = array('Q', [0])
+    self.before.extend(itertools.accumulate(blockCounts))
+    self.ones = self.before[-1]
+    self.zeros = self.count - self.ones
+    self.oneSamples = self._samples(self.ones, self._onesBefore)
+    self.zeroSamples = self._samples(self.zeros, self._zerosBefore)
+
+  def _onesBefore(self, block):
+    return self.before[block]
+
+  def _zerosBefore(self, block):
+    return min(block * RankSelect.BLOCK_BITS, self.count) - self.before[block]
+
+  def _samples(self, total, before):
+    """For every SAMPLE_RATE'th bit of a kind, the block that holds it"""
+    samples = array('Q')
+    block = 0
+    for k in range(0, total, RankSelect.SAMPLE_RATE):
+      while before(block + 1) <= k:
+        block += 1
+      samples.append(block)
+    return samples
+
+  def _block(self, k, samples, before):
+    """The block holding bit k of a kind: before(block) <= k < before(block + 1)"""
+    lo = samples[k // RankSelect.SAMPLE_RATE]
+    j = k // RankSelect.SAMPLE_RATE + 1
+    hi = samples[j] if j < len(samples) else len(self.before) - 2
+    while lo < hi:
+      mid = (lo + hi + 1) // 2
+      if before(mid) <= k:
+        lo = mid
+      else:
+        hi = mid - 1
+    return lo
+
+  def rank1(self, i):
+    """Number of ones below bit i"""
+    if not 0 <= i <= self.count:
+      raise IndexError("rank position %d out of range" % i)
+    block = i // RankSelect.BLOCK_BITS
+    start = block * RankSelect.BLOCK_BITS
+    if i == start:
+      return self.before[block]
+    partial = int.from_bytes(self.data[start // 8:(i + 7) // 8], 'little')
+    return self.before[block] + countOnes(partial & ((1 << (i - start)) - 1))
+
+  def rank0(self, i):
+    """Number of zeros below bit i"""
+    return i - self.rank1(i)
+
+  def _select(self, k, block, remaining, zeros):
+    index = block * RankSelect.BLOCK_BITS
+    offset = index // 8
+    while True:
+      word = int.from_bytes(self.data[offset:offset + _wordBytes], 'little')
+      if zeros:
+        word ^= (1 << _wordBits) - 1
+        if index + _wordBits > self.count:
+          word &= (1 << (self.count - index)) - 1
+      c = countOnes(word)
+      if remaining < c:
+        for _ in range(remaining):
+          word &= word - 1
+        return index + (word & -word).bit_length() - 1
+      remaining -= c
+      index += _wordBits
+      offset += _wordBytes
+
+  def select1(self, k):
+    """Index of the k'th one (counting from 0)"""
+    if not 0 <= k < self.ones:
+      raise IndexError("there is no one number %d" % k)
+    block = self._block(k, self.oneSamples, self._onesBefore)
+    return self._select(k, block, k - self._onesBefore(block), False)
+
+  def select0(self, k):
+    """Index of the k'th zero (counting from 0)"""
+    if not 0 <= k < self.zeros:
+      raise IndexError("there is no zero number %d" % k)
+    block = self._block(k, self.zeroSamples, self._zerosBefore)
+    return self._select(k, block, k - self._zerosBefore(block), True)
+
+
+class _ArrayContainer:
+  """A sparse chunk: the sorted low 16 bits of each one"""
+  def __init__(self, values):
+    self.values = values
+  def countOnes(self):
+    return len(self.values)
+  def __contains__(self, low):
+    i = bisect.bisect_left(self.values, low)
+    return i < len(self.values) and self.values[i] == low
+  def ones(self):
+    return iter(self.values)
+  def toInt(self):
+    return fromOnes(self.values)[0]
+  def copy(self):
+    return _ArrayContainer(array('H', self.values))
+
+class _BitmapContainer:
+  """A dense chunk: all 65536 bits as one integer"""
+  def __init__(self, value, ones):
+    self.value = value
+    self.ones_ = ones
+  def countOnes(self):
+    return self.ones_
+  def __contains__(self, low):
+    return (self.value >> low) & 0x1 == 1
+  def ones(self):
+    return getOnes(self.value, SparseBitmap.CHUNK_SIZE)
+  def toInt(self):
+    return self.value
+  def copy(self):
+    return _BitmapContainer(self.value, self.ones_)
+
+class _RunContainer:
+  """A chunk of long runs: sorted (start, length) pairs"""
+  def __init__(self, runs):
+    self.runs = runs
+    self.starts = [start for (start, _) in runs]
+  def countOnes(self):
+    return sum(length for (_, length) in self.runs)
+  def __contains__(self, low):
+    i = bisect.bisect_right(self.starts, low) - 1
+    return i >= 0 and low < self.runs[i][0] + self.runs[i][1]
+  def ones(self):
+    return itertools.chain.from_iterable(range(start, start + length) for (start, length) in self.runs)
+  def toInt(self):
+    value = 0
+    for (start, length) in self.runs:
+      value |= ((1 << length) - 1) << start
+    return value
+  def copy(self):
+    return self  # runs are never changed in place, only replaced
+
+def _containerFromInt(value):
+  """The smallest container holding the ones of a 65536 bit value, or None if there are none"""
+  ones = countOnes(value)
+  if ones == 0:
+    return None
+  # each run starts and ends with a change between neighbouring bits
+  edges = list(getOnes(value ^ (value << 1), SparseBitmap.CHUNK_SIZE + 1))
+  runCount = len(edges) // 2
+  if 4 * runCount < min(2 * ones, SparseBitmap.CHUNK_SIZE // 8):
+    return _RunContainer([(edges[i], edges[i + 1] - edges[i]) for i in range(0, len(edges), 2)])
+  if ones <= SparseBitmap.ARRAY_LIMIT:
+    return _ArrayContainer(array('H', getOnes(value, SparseBitmap.CHUNK_SIZE)))
+  return _BitmapContainer(value, ones)
+
+def _containerFromSorted(values):
+  if len(values) == 0:
+    return None
+  if len(values) <= SparseBitmap.ARRAY_LIMIT:
+    container = _ArrayContainer(array('H', values))
+    # arrays of long runs still compress better as runs
+    if len(values) < 16 or values[-1] - values[0] >= 2 * len(values):
+      return container
+  return _containerFromInt(fromOnes(values)[0])
+
+class SparseBitmap:
+  """A compressed bitmap with the operators of BitwiseData
+
+  The index space is cut into chunks of 65536 bits (roaring bitmap style).  Each chunk
+  that holds any ones is stored as whichever is smallest of a sorted array of its ones,
+  a 65536 bit integer, or a list of runs, so memory follows the ones rather than count.
+  """
+  CHUNK_BITS = 16
+  CHUNK_SIZE = 1 << CHUNK_BITS
+  ARRAY_LIMIT = 4096
+
+  def __init__(self, count=None):
+    self.count = 0 if count is None else count
+    self.containers = {}  # chunk number -> container
+
+  def __len__(self):
+    return self.count
+
+  def _split(self, i):
+    i = int(i)
+    if i < 0:
+      raise IndexError("SparseBitmap index %d is negative" % i)
+    return (i >> SparseBitmap.CHUNK_BITS, i & (SparseBitmap.CHUNK_SIZE - 1))
+
+  def __contains__(self, i):
+    (chunk, low) = self._split(i)
+    container = self.containers.get(chunk)
+    return container is not None and low in container
+
+  def __getitem__(self, i):
+    return int(i in self)
+
+  def _replace(self, chunk, container):
+    if container is None:
+      self.containers.pop(chunk, None)
+    else:
+      self.containers[chunk] = container
+
+  def add(self, i):
+    (chunk, low) = self._split(i)
+    self.count = max(self.count, i + 1)
+    container = self.containers.get(chunk)
+    if container is None:
+      self.containers[chunk] = _ArrayContainer(array('H', [low]))
+    elif low in container:
+      return
+    elif type(container) == _ArrayContainer and len(container.values) < SparseBitmap.ARRAY_LIMIT:
+      container.values.insert(bisect.bisect_left(container.values, low), low)
+    elif type(container) == _BitmapContainer:
+      container.value |= 1 << low
+      container.ones_ += 1
+    else:
+      value = container.toInt() | (1 << low)
+      self.containers[chunk] = _BitmapContainer(value, container.countOnes() + 1)
+
+  def discard(self, i):
+    (chunk, low) = self._split(i)
+    container = self.containers.get(chunk)
+    if container is None or low not in container:
+      return
+    if type(container) == _ArrayContainer:
+      container.values.remove(low)
+      if not container.values:
+        del self.containers[chunk]
+    elif type(container) == _BitmapContainer and container.ones_ > 1:
+      container.value ^= 1 << low
+      container.ones_ -= 1
+    else:
+      self._replace(chunk, _containerFromInt(container.toInt() & ~(1 << low)))
+
+  def update(self, indices):
+    """Add many indices at once, one container build per chunk"""
+    chunks = {}
+    for i in indices:
+      (chunk, low) = self._split(i)
+      chunks.setdefault(chunk, []).append(low)
+    for (chunk, lows) in chunks.items():
+      self.count = max(self.count, (chunk << SparseBitmap.CHUNK_BITS) + max(lows) + 1)
+      container = self.containers.get(chunk)
+      if container is None:
+        self._replace(chunk, _containerFromSorted(sorted(set(lows))))
+      else:
+        self._replace(chunk, _containerFromInt(container.toInt() | fromOnes(set(lows))[0]))
+    return self
+
+  def optimize(self):
+    """Re-pick the smallest form of every container, e.g. after many single adds"""
+    for chunk in list(self.containers):
+      self._replace(chunk, _containerFromInt(self.containers[chunk].toInt()))
+    return self
+
+  def countOnes(self):
+    return sum(container.countOnes() for container in self.containers.values())
+
+  def countZeros(self):
+    return self.count - self.countOnes()
+
+  def ones(self):
+    for chunk in sorted(self.containers):
+      base = chunk << SparseBitmap.CHUNK_BITS
+      for low in self.containers[chunk].ones():
+        yield base + low
+
+  def _combine(self, other, op, keepLeft, keepRight):
+    if type(other) != SparseBitmap:
+      other = SparseBitmap.fromBitwiseData(BitwiseData.convert(other))
+    result = SparseBitmap(max(self.count, other.count))
+    for chunk in set(self.containers) | set(other.containers):
+      a = self.containers.get(chunk)
+      b = other.containers.get(chunk)
+      if b is None:
+        container = a if keepLeft else None
+      elif a is None:
+        container = b if keepRight else None
+      elif type(a) == _ArrayContainer and type(b) == _ArrayContainer:
+        container = _containerFromSorted(sorted(op(set(a.values), set(b.values))))
+      else:
+        container = _containerFromInt(op(a.toInt(), b.toInt()))
+      if container is not None:
+        result.containers[chunk] = container.copy()
+    return result
+
+  def __or__(self, other):
+    return self._combine(other, lambda a, b: a | b, True, True)
+  def __and__(self, other):
+    return self._combine(other, lambda a, b: a & b, False, False)
+  def __xor__(self, other):
+    return self._combine(other, lambda a, b: a ^ b, True, True)
+
+  def bitDistance(self, other):
+    if type(other) != SparseBitmap:
+      other = SparseBitmap.fromBitwiseData(BitwiseData.convert(other))
+    distance = 0
+    for chunk in set(self.containers) | set(other.containers):
+      a = self.containers.get(chunk)
+      b = other.containers.get(chunk)
+      if a is None or b is None:
+        distance += (a or b).countOnes()
+      elif type(a) == _ArrayContainer and type(b) == _ArrayContainer:
+        distance += len(set(a.values) ^ set(b.values))
+      else:
+        distance += countOnes(a.toInt() ^ b.toInt())
+    return distance
+
+  def correlate(self, other):
+    return self.count - 2 * self.bitDistance(other)
+
+  def __eq__(self, other):
+    if type(other) == BitwiseData:
+      other = SparseBitmap.fromBitwiseData(other)
+    if type(other) != SparseBitmap:
+      return False
+    return self.count == other.count and self.bitDistance(other) == 0
+  def __ne__(self, other):
+    return not self.__eq__(other)
+  __hash__ = None
+
+  def __repr__(self):
+    return "SparseBitmap(%d, %d ones in %d chunks)" % (self.count, self.countOnes(), len(self.containers))
+
+  @staticmethod
+  def createFromOnes(ones_indices, count=None):
+    result = SparseBitmap(count).update(ones_indices)
+    return result
+
+  @staticmethod
+  def fromBitwiseData(bitwiseData):
+    result = SparseBitmap(bitwiseData.count)
+    data = bitwiseData.toBytes()
+    chunkBytes = SparseBitmap.CHUNK_SIZE // 8
+    for (chunk, start) in enumerate(range(0, len(data), chunkBytes)):
+      piece = data[start:start + chunkBytes]
+      if piece.count(0) == len(piece):
+        continue
+      result._replace(chunk, _containerFromInt(int.from_bytes(piece, 'little')))
+    return result
+
+  def toBitwiseData(self):
+    chunkBytes = SparseBitmap.CHUNK_SIZE // 8
+    data = bytearray((self.count + 7) // 8)
+    for (chunk, container) in self.containers.items():
+      start = chunk * chunkBytes
+      piece = container.toInt().to_bytes(chunkBytes, 'little')[:len(data) - start]
+      data[start:start + len(piece)] = piece
+    return BitwiseData(self.count, int.from_bytes(data, 'little'))
+
+
+class HammingIndex:
+  """Stores fixed width codes for exact Hamming distance neighbour queries
+
+  Multi-index hashing: each code is cut into substringCount substrings and every
+  substring gets its own hash table.  A code within distance r of the query agrees with
+  it to within r // substringCount bits on at least one substring (pigeonhole), so only
+  the buckets near the query's substrings are probed.  Every candidate is checked with
+  bitDistance, so results are exactly those of a linear scan, ties in insertion order.
+  """
+  DEFAULT_SUBSTRING_WIDTH = 16
+  def __init__(self, width, substringCount=None):
+    if substringCount is None:
+      substringCount = max(1, width // HammingIndex.DEFAULT_SUBSTRING_WIDTH)
+    substringCount = min(substringCount, width)
+    self.width = width
+    self.substrings = []  # (start, count) of each substring
+    start = 0
+    for i in range(substringCount):
+      count = (width - start) // (substringCount - i)
+      self.substrings.append((start, count))
+      start += count
+    self.tables = [{} for _ in self.substrings]
+    self.codes = {}  # key -> (value, insertion sequence)
+    self.nextKey = 0
+    self.sequence = 0
+
+  def __len__(self):
+    return len(self.codes)
+
+  def __contains__(self, key):
+    return key in self.codes
+
+  def __getitem__(self, key):
+    return BitwiseData(self.width, self.codes[key][0])
+
+  def _value(self, code):
+    value = code.value if type(code) == BitwiseData else int(code)
+    if value < 0 or value.bit_length() > self.width:
+      raise ValueError("code does not fit in width %d" % self.width)
+    return value
+
+  def _keys(self, value):
+    return [(value >> start) & ((1 << count) - 1) for (start, count) in self.substrings]
+
+  def insert(self, code, key=None):
+    """Add a code, returning its key (consecutive integers unless one is given)"""
+    if key is None:
+      while self.nextKey in self.codes:
+        self.nextKey += 1
+      key = self.nextKey
+      self.nextKey += 1
+    elif key in self.codes:
+      self.delete(key)
+    value = self._value(code)
+    self.codes[key] = (value, self.sequence)
+    self.sequence += 1
+    for (table, sub) in zip(self.tables, self._keys(value)):
+      bucket = table.get(sub)
+      if bucket is None:
+        table[sub] = {key}
+      else:
+        bucket.add(key)
+    return key
+
+  def delete(self, key):
+    (value, _) = self.codes.pop(key)
+    for (table, sub) in zip(self.tables, self._keys(value)):
+      bucket = table[sub]
+      bucket.discard(key)
+      if not bucket:
+        del table[sub]
+
+  def _probe(self, subs, distance, found, query):
+    """Add to found the distance of every code sharing a substring within exactly distance"""
+    for ((_, count), table, sub) in zip(self.substrings, self.tables, subs):
+      if distance > count:
+        continue
+      for flips in itertools.combinations(range(count), distance):
+        v = sub
+        for f in flips:
+          v ^= 1 << f
+        bucket = table.get(v)
+        if bucket is None:
+          continue
+        for key in bucket:
+          if key not in found:
+            found[key] = bitDistance(query, self.codes[key][0])
+
+  def _probeCount(self, distance):
+    """Number of buckets _probe visits at this distance"""
+    total = 0
+    for (_, count) in self.substrings:
+      c = 1
+      for t in range(distance):
+        c = c * (count - t) // (t + 1)
+      total += c
+    return total
+
+  def _scan(self, query):
+    return {key: bitDistance(query, v) for (key, (v, _)) in self.codes.items()}
+
+  def _sorted(self, found, limit=None):
+    result = [(d, key) for (key, d) in found.items() if limit is None or d <= limit]
+    result.sort(key=lambda dk: (dk[0], self.codes[dk[1]][1]))
+    return result
+
+  def radius(self, code, r):
+    """All (distance, key) pairs within distance r of code, nearest first"""
+    query = self._value(code)
+    levels = range(r // len(self.substrings) + 1)
+    if sum(self._probeCount(distance) for distance in levels) > len(self.codes):
+      return self._sorted(self._scan(query), r)
+    subs = self._keys(query)
+    found = {}
+    for distance in levels:
+      self._probe(subs, distance, found, query)
+    return self._sorted(found, r)
+
+  def nearest(self, code, k=1):
+    """The k (distance, key) pairs nearest to code, nearest first"""
+    query = self._value(code)
+    subs = self._keys(query)
+    found = {}
+    probes = 0
+    for distance in range(self.width + 1):
+      probes += self._probeCount(distance)
+      if k >= len(self.codes) or probes > len(self.codes):
+        # probing further would cost more than looking at every code
+        found = self._scan(query)
+        break
+      self._probe(subs, distance, found, query)
+      # every code within this bound has a substring within distance, so it is in found
+      bound = len(self.substrings) * (distance + 1) - 1
+      if sum(1 for d in found.values() if d <= bound) >= k:
+        break
+    return self._sorted(found)[:k]
+
 
 if __name__ == '__main__':
   """Unit Testing"""
@@ -400,6 +2322,36 @@ if __name__ == '__main__':
       self.assertEqual(highestOneIndex(1 << 1023), 1023)
       self.assertEqual(highestOneIndex((1 << 1024)-1), 1023)
 
+    def test_countOnesCache(self):
+      cache = PopcountCache(maxsize=2)
+      self.assertEqual(cache.countOnes(0b1011), 3)
+      self.assertEqual(cache.countOnes(0b1011), 3)
+      self.assertEqual(cache.countOnes(0b1), 1)
+      self.assertEqual(cache.countOnes(0b11), 2)
+      info = cache.info()
+      self.assertEqual((info['hits'], info['misses'], info['evictions'], info['size'], info['bits']),
+                       (1, 3, 1, 2, 3))
+      cache = PopcountCache(maxsize=100, maxBits=1000)
+      for k in range(1, 6):
+        cache.countOnes((1 << 300) - k)
+      self.assertEqual((len(cache.counts), cache.bits, cache.evictions), (3, 900, 2))
+      self.assertEqual(cache.countOnes((1 << 2000) - 1), 2000)  # too big to keep
+      self.assertEqual((len(cache.counts), cache.bits), (3, 900))
+      cache.resize(100, 500)
+      self.assertEqual((len(cache.counts), cache.bits), (1, 300))
+      cache.clear()
+      self.assertEqual((cache.info()['size'], cache.bits), (0, 0))
+      clearCountOnesCache()
+      self.assertEqual(countOnes(0b1011, useCache=True), 3)
+      self.assertEqual(countZeros(0b11, 8, useCache=True), 6)
+      # the module cache is only used without int.bit_count
+      self.assertEqual(countOnesCacheInfo()['size'], 0 if _hasBitCount else 2)
+      clearCountOnesCache()
+      self.assertEqual(countOnesNative((1 << 1000) - 1), 1000)
+      self.assertEqual(countOnesByParcel((1 << 1000) - 1), 1000)
+      self.assertEqual(list(_getOnesParcelMap()[:9]), [0, 1, 1, 2, 1, 2, 2, 3, 1])
+      self.assertEqual(_getOnesParcelMap()[(1 << 16) - 1], 16)
+
   class BitwiseDataTests(unittest.TestCase):
     def test_len(self):
       bitwiseData = BitwiseData(99, 0)
@@ -531,6 +2483,22 @@ if __name__ == '__main__':
       a = BitwiseData(8, 0b11001010)
       self.assertEqual([zero for zero in a.zeros()], [0, 2, 4, 5])
 
+    def test_wordIteration(self):
+      r = random.Random(7)
+      for count in (1, 7, 8, 63, 64, 65, 200, 1000):
+        for density in (0.0, 0.03, 0.5, 0.97, 1.0):
+          bits = [int(r.random() < density) for _ in range(count)]
+          a = BitwiseData.createFromList(bits)
+          self.assertEqual(list(a), bits)
+          self.assertEqual(list(a.getIndexedBits()), list(enumerate(bits)))
+          self.assertEqual(list(a.ones()), [i for (i, b) in enumerate(bits) if b])
+          self.assertEqual(list(a.zeros()), [i for (i, b) in enumerate(bits) if not b])
+          self.assertEqual(list(getOnes(a.value)), [i for (i, b) in enumerate(bits) if b])
+          self.assertEqual(a.bitStr(), ''.join(str(b) for b in reversed(bits)))
+      self.assertEqual(bitStr(0b10110100, 8, 3), '10 110 100')
+      self.assertEqual(bitStr(0b10110100, 9, 3, '_'), '010_110_100')
+      self.assertEqual(bitStr(-1, 4), '1111')
+
     def test_increaseCapacity(self):
       a = BitwiseData(8, 0b11001010)
       self.assertEqual(len(a), 8)
@@ -676,6 +2644,35 @@ if __name__ == '__main__':
       c = BitwiseData.convertBytes(a, msb_first=True)
       self.assertEqual(c, BitwiseData(16, 0x55F0))
 
+    def test_buffers(self):
+      a = BitwiseData(16, 0xAA0F)
+      for buffer in (bytes([0x0F, 0xAA]), bytearray([0x0F, 0xAA]), memoryview(bytes([0x0F, 0xAA]))):
+        self.assertEqual(BitwiseData.fromBuffer(buffer), a)
+        self.assertEqual(BitwiseData.fromBuffer(buffer, msb_first=True), BitwiseData(16, 0x55F0))
+      self.assertEqual(BitwiseData.fromBuffer(array('H', [0xAA0F])), a)
+      self.assertEqual(a.toBytes(), bytes([0x0F, 0xAA]))
+      self.assertEqual(a.toBytes(msb_first=True), bytes([0xF0, 0x55]))
+      self.assertEqual(BitwiseData(10, 0b1100000001).toBytes(), bytes([0x01, 0x03]))
+      r = random.Random(5)
+      for count in (8, 64, 1000):
+        b = BitwiseData.randomized(count, r.getrandbits)
+        for msb_first in (False, True):
+          self.assertEqual(BitwiseData.fromBuffer(b.toBytes(msb_first), msb_first), b)
+
+    def test_files(self):
+      import tempfile
+      a = BitwiseData.randomized(8 * 4099)
+      with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bits')
+        for msb_first in (False, True):
+          a.writeTo(path, msb_first)
+          self.assertEqual(BitwiseData.fromFile(path, msb_first), a)
+        with open(path, 'wb') as f:
+          a.writeTo(f)
+        self.assertEqual(BitwiseData.fromFile(path), a)
+        open(path, 'wb').close()
+        self.assertEqual(BitwiseData.fromFile(path), BitwiseData(0, 0))
+
     def test_slice(self):
       a = BitwiseData(8, 0b10110100)
       self.assertEqual(a[:], 0b10110100)
@@ -684,6 +2681,20 @@ if __name__ == '__main__':
       self.assertEqual(a[::-1], 0b00101101)
       self.assertEqual(a[5:3:-1], 0b11)
 
+    def test_sliceSteps(self):
+      r = random.Random(6)
+      a = BitwiseData.randomized(300, r.getrandbits)
+      bits = [bit for bit in a]
+      for key in (slice(3, 250), slice(None, None, -1), slice(280, 10, -1), slice(5, None, 3),
+                  slice(None, 4, -7), slice(-1, -200, -2), slice(64, 128)):
+        self.assertEqual(a[key], BitwiseData.createFromList(bits[key]))
+        self.assertEqual(a.view(key), BitwiseData.createFromList(bits[key]))
+      v = a.view(slice(10, 200))[::-1][5:50:4]
+      self.assertEqual(len(v), len(bits[10:200][::-1][5:50:4]))
+      self.assertEqual(v.materialize(), BitwiseData.createFromList(bits[10:200][::-1][5:50:4]))
+      self.assertEqual(v[1], bits[10:200][::-1][5:50:4][1])
+      self.assertRaises(ValueError, lambda: a[5:5])
+
     def mock_rng(self, mockBitCount, mockBits):
       def rng(bitCount):
         self.assertEqual(bitCount, mockBitCount, f'This mock only responds to bit counts of {mockBitCount}')
@@ -712,12 +2723,23 @@ if __name__ == '__main__':
       self.assertEqual(b, BitwiseData(8, 0b01100001))
       c = a.withFlips([2,3,4])
       self.assertEqual(c, BitwiseData(8, 0b01111001))
+      d = a.withFlips([])
+      self.assertEqual(d, a)
+      e = a.withFlips(i for i in (2, 9))
+      self.assertEqual(e, BitwiseData(10, 0b1001100001))
+      f = BitwiseData(8).withFlips(range(0, 200, 2))
+      self.assertEqual(f, BitwiseData(199, int('01' * 100, 2)))
 
     def test_fromOnes(self):
       a = BitwiseData.createFromOnes({3, 5, 6})
       self.assertEqual(a, BitwiseData(7, 0b1101000))
       b = BitwiseData.createFromOnes({2, 4, 5}, 8)
       self.assertEqual(b, BitwiseData(8, 0b00110100))
+      many = list(range(0, 300, 3))
+      self.assertEqual(fromOnes(many + [7, 7]), (sum(1 << i for i in many), 297))
+      self.assertRaises(ValueError, fromOnes, [5, -1])
+      self.assertRaises(ValueError, fromOnes, many + [-9])
+      self.assertRaises(ValueError, BitwiseData(300).withFlips, many + [-9])
 
     def test_split(self):
       a = BitwiseData(8, 0b01101001)
@@ -729,7 +2751,335 @@ if __name__ == '__main__':
       a4 = a.split(4)
       self.assertEqual(a4[0], BitwiseData(4, 0b1001))
       self.assertEqual(a4[1], BitwiseData(4, 0b0110))
+      a7 = BitwiseData(7, 0b1101001).split(3)
+      self.assertEqual(a7, [BitwiseData(3, 0b001), BitwiseData(3, 0b101), BitwiseData(1, 0b1)])
       
       
+  class BitwiseArrayTests(unittest.TestCase):
+    def test_roundTrip(self):
+      rows = [BitwiseData(70, 0), BitwiseData(70, 1 << 69 | 0b101), BitwiseData(70, (1 << 70) - 1)]
+      a = BitwiseArray.createFromList(rows)
+      self.assertEqual(len(a), 3)
+      self.assertEqual(a.wordsPerRow, 2)
+      self.assertEqual(a.toList(), rows)
+      self.assertEqual(a[-1], rows[2])
+      self.assertEqual(a[1:].toList(), rows[1:])
+      self.assertEqual(a[::-1].toList(), rows[::-1])
+      a[0] = BitwiseData(70, 0b11)
+      self.assertEqual(a[0], BitwiseData(70, 0b11))
+      self.assertRaises(ValueError, a.append, BitwiseData(71, 1 << 70))
+
+    def test_bitwiseOperators(self):
+      a = BitwiseArray.createFromList([BitwiseData(4, 0b1100), BitwiseData(4, 0b1010)])
+      b = BitwiseArray.createFromList([BitwiseData(4, 0b1010), BitwiseData(4, 0b0110)])
+      self.assertEqual((a ^ b).toList(), [0b0110, 0b1100])
+      self.assertEqual((a & b).toList(), [0b1000, 0b0010])
+      self.assertEqual((a | b).toList(), [0b1110, 0b1110])
+      self.assertEqual((~a).toList(), [0b0011, 0b0101])
+      self.assertEqual((a ^ BitwiseData(4, 0b1111)).toList(), [0b0011, 0b0101])
+
+    def test_countOnes(self):
+      r = random.Random(1)
+      for width in (1, 8, 63, 64, 65, 200, 256):
+        rows = [BitwiseData.randomized(width, r.getrandbits) for _ in range(17)]
+        a = BitwiseArray.createFromList(rows, width)
+        self.assertEqual(list(a.countOnes()), [bd.countOnes() for bd in rows])
+        self.assertEqual(list(a.countZeros()), [bd.countZeros() for bd in rows])
+        q = BitwiseData.randomized(width, r.getrandbits)
+        self.assertEqual(list(a.bitDistance(q)), [bd.bitDistance(q) for bd in rows])
+        b = BitwiseArray.createFromList(rows[::-1], width)
+        self.assertEqual(list(a.bitDistance(b)), [x.bitDistance(y) for (x, y) in zip(rows, rows[::-1])])
+
+    def test_randomized(self):
+      a = BitwiseArray.randomized(70, 1000, randomStream(1).getrandbits)
+      self.assertEqual(a, BitwiseArray.randomized(70, 1000, randomStream(1).getrandbits))
+      self.assertNotEqual(a, BitwiseArray.randomized(70, 1000, randomStream(1, 2).getrandbits))
+      self.assertTrue(all(bd.value < (1 << 70) for bd in a))
+      self.assertTrue(abs(sum(a.countOnes()) - 35000) < 1000)
+      b = BitwiseArray.randomized(70, 1000, randomStream(2).getrandbits, p=0.1)
+      self.assertTrue(abs(sum(b.countOnes()) - 7000) < 600)
+      self.assertEqual(sum(BitwiseArray.randomized(70, 10, p=0).countOnes()), 0)
+      self.assertEqual(sum(BitwiseArray.randomized(70, 10, p=1).countOnes()), 700)
+      self.assertEqual((a.width, len(a)), (70, 1000))
+      c = BitwiseArray.randomizedWithWeight(70, 200, 9, randomStream(3).getrandbits)
+      self.assertEqual(set(c.countOnes()), {9})
+      self.assertEqual(len(set(bd.value for bd in c)), 200)
+
+  class HammingIndexTests(unittest.TestCase):
+    def bruteForce(self, codes, query, r=None):
+      result = [(query.bitDistance(c), key) for (key, c) in codes.items()]
+      result.sort()
+      return [dk for dk in result if r is None or dk[0] <= r]
+
+    def test_queries(self):
+      r = random.Random(2)
+      for (width, substringCount) in ((64, None), (40, 3), (7, 7)):
+        index = HammingIndex(width, substringCount)
+        codes = {}
+        for _ in range(300):
+          code = BitwiseData.randomized(width, r.getrandbits)
+          codes[index.insert(code)] = code
+        # many near duplicates, so small radii have something to find
+        for key in list(codes)[:100]:
+          code = codes[key].withFlips(r.sample(range(width), r.randrange(1, 4)))
+          codes[index.insert(code)] = code
+        for key in list(codes)[::7]:
+          index.delete(key)
+          del codes[key]
+        self.assertEqual(len(index), len(codes))
+        for _ in range(20):
+          query = codes[r.choice(list(codes))].withFlips(r.sample(range(width), r.randrange(1, 5)))
+          for radius in (0, 3, 9, width):
+            self.assertEqual(index.radius(query, radius), self.bruteForce(codes, query, radius))
+          for k in (1, 5, 40, len(codes) + 1):
+            self.assertEqual(index.nearest(query, k), self.bruteForce(codes, query)[:k])
+
+  class BitBuilderTests(unittest.TestCase):
+    def test_append(self):
+      b = BitBuilder()
+      b.append(0b101, 3).append(BitwiseData(2, 0b10)).extend([1, 0, 0, 1])
+      self.assertEqual(len(b), 9)
+      self.assertEqual(b.freeze(), BitwiseData(9, 0b100110101))
+      r = random.Random(3)
+      pieces = [BitwiseData.randomized(r.randrange(1, 150), r.getrandbits) for _ in range(200)]
+      b = BitBuilder()
+      for piece in pieces:
+        b.append(piece)
+      value = 0
+      for piece in reversed(pieces):
+        value = (value << piece.count) | piece.value
+      self.assertEqual(b.freeze(), BitwiseData(sum(len(p) for p in pieces), value))
+
+    def test_appendBytes(self):
+      b = BitBuilder().append(0b1, 1).appendBytes(bytes([0x0F, 0xAA]))
+      self.assertEqual(b.freeze(), BitwiseData(17, 0xAA0F << 1 | 1))
+      b = BitBuilder().appendBytes(bytes([0x0F]), msb_first=True)
+      self.assertEqual(b.freeze(), BitwiseData(8, 0xF0))
+
+    def test_setClearFlip(self):
+      b = BitBuilder().append(0, 100)
+      b.set(3).set(90).flip(91).flip(3).clear(90).set(-1)
+      self.assertEqual(b[91], 1)
+      self.assertEqual(b[3], 0)
+      self.assertEqual(b.freeze(), BitwiseData(100, (1 << 99) | (1 << 91)))
+      self.assertRaises(IndexError, b.set, 100)
+
+  class RankSelectTests(unittest.TestCase):
+    def test_rankSelect(self):
+      r = random.Random(4)
+      for count in (1, 8, 64, 2047, 2048, 5000, 20000):
+        for density in (0.0, 0.01, 0.5, 0.99, 1.0):
+          bd = BitBuilder().extend(r.random() < density for _ in range(count)).freeze()
+          indexed = bd.withRankSelect()
+          ones = list(bd.ones())
+          zeros = list(bd.zeros())
+          for k in sorted(set(range(0, len(ones), 97)) | set(range(max(0, len(ones) - 1), len(ones)))):
+            self.assertEqual(indexed.nthOne(k), ones[k])
+          for k in sorted(set(range(0, len(zeros), 97)) | set(range(max(0, len(zeros) - 1), len(zeros)))):
+            self.assertEqual(indexed.nthZero(k), zeros[k])
+          for i in list(range(0, count + 1, 61)) + [count]:
+            self.assertEqual(indexed.rank1(i), bd.rank1(i))
+            self.assertEqual(indexed.rank0(i), i - bd.rank1(i))
+          self.assertRaises(IndexError, indexed.nthOne, len(ones))
+          self.assertRaises(IndexError, indexed.nthZero, len(zeros))
+          # the directory reads the one shared byte buffer rather than a copy of its own
+          self.assertIs(indexed.rankSelect.data, indexed.toBytes())
+          self.assertEqual(indexed.toBytes(), bd.toBytes())
+          self.assertEqual(len(indexed.rankSelect.before), (count + 2047) // 2048 + 1)
+
+  class SparseBitmapTests(unittest.TestCase):
+    def sample(self, r):
+      ones = set(r.sample(range(1 << 20), 300))                      # sparse arrays
+      ones |= set(range(3 << 16, (3 << 16) + 30000))                   # one long run
+      ones |= set(i for i in range(5 << 16, 6 << 16) if r.random() < 0.5)  # dense bitmap
+      return ones
+
+    def test_sparseBitmap(self):
+      r = random.Random(8)
+      aOnes = self.sample(r)
+      bOnes = self.sample(r)
+      count = 1 << 21
+      a = SparseBitmap.createFromOnes(aOnes, count)
+      b = SparseBitmap(count)
+      for i in bOnes:
+        b.add(i)
+      b.optimize()
+      kinds = set(type(c).__name__ for c in a.containers.values())
+      self.assertEqual(kinds, {'_ArrayContainer', '_RunContainer', '_BitmapContainer'})
+      self.assertEqual(list(a.ones()), sorted(aOnes))
+      self.assertEqual(a.countOnes(), len(aOnes))
+      self.assertEqual(list((a | b).ones()), sorted(aOnes | bOnes))
+      self.assertEqual(list((a & b).ones()), sorted(aOnes & bOnes))
+      self.assertEqual(list((a ^ b).ones()), sorted(aOnes ^ bOnes))
+      self.assertEqual(a.bitDistance(b), len(aOnes ^ bOnes))
+      self.assertTrue(12 in a or 12 not in aOnes)
+      dense = a.toBitwiseData()
+      self.assertEqual(dense, BitwiseData.createFromOnes(aOnes, count))
+      self.assertEqual(SparseBitmap.fromBitwiseData(dense), a)
+      self.assertEqual(a.bitDistance(b), dense.bitDistance(b.toBitwiseData()))
+      for i in list(aOnes)[:50]:
+        a.discard(i)
+      self.assertEqual(a.countOnes(), len(aOnes) - 50)
+
+  class BloomFilterTests(unittest.TestCase):
+    def test_bloomFilters(self):
+      items = ["item %d" % i for i in range(5000)]
+      others = ["other %d" % i for i in range(20000)]
+      for kind in (BloomFilter, BlockedBloomFilter, CountingBloomFilter):
+        a = kind(len(items), 0.01, seed=3)
+        a.update(items[:3000])
+        for item in items[3000:]:
+          a.add(item)
+        self.assertTrue(all(a.contains(items)))
+        self.assertTrue(items[7] in a)
+        self.assertLess(sum(a.contains(others)) / len(others), 0.02)
+        self.assertAlmostEqual(a.estimatedCount() / len(items), 1, delta=0.05)
+        self.assertEqual(kind.fromBytes(a.toBytes()), a)
+        self.assertEqual(BloomFilter.fromBytes(bytearray(a.toBytes())), a)
+        self.assertEqual(a.toBitwiseData().countOnes(), a.countOnes())
+        b = kind(len(items), 0.01, seed=3)
+        b.update(items[2000:] + others[:100])
+        union = a | b
+        self.assertTrue(all(union.contains(items + others[:100])))
+        both = a & b
+        self.assertTrue(all(both.contains(items[2000:])))
+        self.assertLessEqual(both.countOnes(), min(a.countOnes(), b.countOnes()))
+        self.assertRaises(ValueError, a.__or__, kind(len(items), 0.01, seed=4))
+        self.assertRaises(ValueError, a.__and__, kind(2 * len(items), 0.01, seed=3))
+      self.assertRaises(ValueError, BloomFilter.fromBytes, b'not a filter at all, no not at all')
+      self.assertEqual(BloomFilter(bitCount=100, hashCount=3).toBitwiseData(), BitwiseData(104, 0))
+      c = CountingBloomFilter(100, 0.01)
+      c.update([1, 2, 2, b'three'])
+      self.assertTrue(c.discard(2))
+      self.assertTrue(2 in c)
+      self.assertTrue(c.discard(2))
+      self.assertFalse(2 in c)
+      self.assertFalse(c.discard(2))
+      self.assertEqual(c.contains([1, b'three', BitwiseData(3, 0b11)]), [True, True, False])
+      self.assertEqual(c.toBloomFilter().toBitwiseData(), c.toBitwiseData())
+      self.assertEqual(c.toBitwiseData().countOnes(), c.countOnes())
+
+    def test_keysByType(self):
+      keys = [1, b'\x01', '\x01', BitwiseData(8, 1), BitwiseData(16, 1)]
+      self.assertEqual(len(set(map(_bloomKey, keys))), len(keys))
+      self.assertEqual(_bloomKey(bytearray(b'\x01')), _bloomKey(b'\x01'))
+      a = BloomFilter(bitCount=1 << 16, hashCount=4)
+      a.add(BitwiseData(8, 1))
+      self.assertEqual(a.contains(keys), [False, False, False, True, False])
+
+
+  class BitStreamTests(unittest.TestCase):
+    def test_roundTrip(self):
+      import io
+      r = random.Random(9)
+      fields = [(w, r.getrandbits(w)) for w in (r.randrange(1, 100) for _ in range(500))]
+      for msb_first in (False, True):
+        stream = io.BytesIO()
+        with BitWriter(stream, msb_first, bufferSize=16) as writer:
+          for (width, value) in fields:
+            writer.write(value, width)
+        total = sum(w for (w, _) in fields)
+        self.assertEqual(len(stream.getvalue()), (total + 7) // 8)
+        whole = BitwiseData.fromBuffer(stream.getvalue(), msb_first)
+        for source in (io.BytesIO(stream.getvalue()), stream.getvalue()):
+          reader = BitReader(source, msb_first, bufferSize=5)
+          position = 0
+          for (width, value) in fields:
+            self.assertEqual(reader.peek(width), value)
+            if width % 3:
+              self.assertEqual(reader.read(width), value)
+            else:
+              self.assertEqual(reader.read(width, bitwise=True), whole.substr(position, width))
+            position += width
+          self.assertEqual(reader.tell(), total)
+          reader.align()
+          self.assertRaises(EOFError, reader.read, 1)
+
+    def test_orders(self):
+      self.assertEqual(BitWriter().write(0b101, 3).write(0b11, 2).getvalue(), bytes([0b11101]))
+      self.assertEqual(BitWriter(msb_first=True).write(0b101, 3).write(0b11, 2).getvalue(),
+                       bytes([0b10111000]))
+      self.assertEqual(BitWriter(msb_first=True).write(BitwiseData(3, 0b001)).getvalue(), bytes([0b10000000]))
+      reader = BitReader(bytes([0xA5, 0xFF, 0x0F]), msb_first=True)
+      self.assertEqual(reader.read(4), 0xA)
+      reader.skip(12)
+      self.assertEqual(reader.read(4), 0x0)
+      reader = BitReader(bytes([0xA5, 0xFF, 0x0F]))
+      self.assertEqual(reader.read(4), 0x5)
+      reader.align()
+      self.assertEqual(reader.read(12), 0xFFF)
+
+  class PairTests(unittest.TestCase):
+    def test_pairs(self):
+      r = random.Random(10)
+      a = [BitwiseData.randomized(70, r.getrandbits) for _ in range(23)]
+      b = [BitwiseData.randomized(70, r.getrandbits) for _ in range(9)]
+      for processes in (1, 2):
+        full = pairMatrix(a, tileSize=5, processes=processes)
+        self.assertEqual([list(row) for row in full], [[x.bitDistance(y) for y in a] for x in a])
+        upper = pairMatrix(a, upper=True, tileSize=4, processes=processes)
+        self.assertEqual([list(row) for row in upper],
+                         [[x.bitDistance(y) for y in a[i + 1:]] for (i, x) in enumerate(a)])
+        cross = pairMatrix(a, b, correlation=True, tileSize=6, processes=processes)
+        self.assertEqual([list(row) for row in cross], [[x.correlate(y) for y in b] for x in a])
+      close = pairsWithin(a, 32, tileSize=7, processes=1)
+      self.assertEqual(close, [(i, j, a[i].bitDistance(a[j])) for i in range(len(a))
+                               for j in range(i + 1, len(a)) if a[i].bitDistance(a[j]) <= 32])
+      similar = pairsWithin(a, 6, b, correlation=True, tileSize=7, processes=1)
+      self.assertEqual(similar, [(i, j, a[i].correlate(b[j])) for i in range(len(a))
+                                 for j in range(len(b)) if a[i].correlate(b[j]) >= 6])
+
+  class BitMatrixTests(unittest.TestCase):
+    def slowRank(self, rows):
+      rows = list(rows)
+      rank = 0
+      for col in range(max([r.bit_length() for r in rows] + [0])):
+        pivot = next((i for i in range(rank, len(rows)) if (rows[i] >> col) & 1), None)
+        if pivot is None:
+          continue
+        (rows[rank], rows[pivot]) = (rows[pivot], rows[rank])
+        for i in range(len(rows)):
+          if i != rank and (rows[i] >> col) & 1:
+            rows[i] ^= rows[rank]
+        rank += 1
+      return rank
+
+    def test_linearAlgebra(self):
+      r = random.Random(11)
+      for (n, m) in ((1, 1), (5, 9), (17, 17), (40, 33), (64, 70)):
+        a = BitMatrix.randomized(n, m, r.getrandbits)
+        # make some rows dependent so the rank is not always full
+        for i in range(0, n - 2, 3):
+          a.rows[i] = a.rows[i + 1] ^ a.rows[i + 2]
+        rank = self.slowRank(a.rows)
+        for k in (1, 3, None):
+          (partial, pivots) = a.echelon(k, reduced=False)
+          self.assertEqual(len(pivots), rank)
+          for (t, p) in enumerate(pivots):
+            self.assertEqual([(row >> p) & 1 for row in partial.rows[t:]], [1] + [0] * (n - t - 1))
+          (reduced, pivots) = a.echelon(k)
+          self.assertEqual(len(pivots), rank)
+          self.assertEqual(reduced.rows[rank:], [0] * (n - rank))
+          for (t, p) in enumerate(pivots):
+            self.assertEqual([(row >> p) & 1 for row in reduced.rows], [int(i == t) for i in range(n)])
+        self.assertEqual(a.transpose().transpose(), a)
+        self.assertEqual(a.transpose()[(m - 1, n - 1)], a[(n - 1, m - 1)])
+        self.assertEqual(a.rank(), a.transpose().rank())
+        basis = a.nullspace()
+        self.assertEqual(len(basis), m - rank)
+        for x in basis:
+          self.assertEqual((a * x).countOnes(), 0)
+        x = BitwiseData.randomized(m, r.getrandbits)
+        b = a * x
+        self.assertEqual(a * a.solve(b), b)
+        c = BitMatrix.randomized(m, 13, r.getrandbits)
+        product = a * c
+        for j in range(13):
+          column = BitwiseData(m, c.transpose().rows[j])
+          self.assertEqual(BitwiseData(n, product.transpose().rows[j]), a * column)
+      self.assertEqual(BitMatrix.identity(5) * BitMatrix.identity(5), BitMatrix.identity(5))
+      singular = BitMatrix.fromRows([BitwiseData(2, 0b11), BitwiseData(2, 0b11)])
+      self.assertRaises(ValueError, singular.solve, BitwiseData(2, 0b01))
+
   if __name__ == '__main__':
     unittest.main()
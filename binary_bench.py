@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+# binary_bench.py
+#
+# timings for binary.py
+#
+#   binary_bench.py run [-o results.json]        time the hot paths over a sweep of bit widths
+#   binary_bench.py compare baseline.json [new]  flag regressions against a stored run
+#   binary_bench.py hamming                      HammingIndex queries against a linear scan
+#   binary_bench.py imports                      cold start import time of binary, genetics, stats
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+from binary import BitwiseData, BitwiseArray, HammingIndex, highestOneIndex
+
+DEFAULT_WIDTHS = [8, 64, 1000, 10**4, 10**5, 10**6, 10**7]
+
+def timed(f, *args):
+  start = time.perf_counter()
+  result = f(*args)
+  return (time.perf_counter() - start, result)
+
+def timePerCall(f, minTime=0.05, repeat=3):
+  """Best of repeat measurements of seconds per call, each looping for at least minTime"""
+  loops = 1
+  while True:
+    (elapsed, _) = timed(lambda: [f() for _ in range(loops)])
+    if elapsed >= minTime or loops >= 1 << 20:
+      break
+    loops *= 10 if elapsed < minTime / 10 else 2
+  best = elapsed / loops
+  for _ in range(repeat - 1):
+    (elapsed, _) = timed(lambda: [f() for _ in range(loops)])
+    best = min(best, elapsed / loops)
+  return best
+
+# each benchmark takes a random BitwiseData of the width under test and returns the
+# callable to time; preparation done here is not timed
+def benchConstruct(a):
+  return lambda: BitwiseData(a.count, a.value)
+
+def benchHighestOneIndex(a):
+  return lambda: highestOneIndex(a.value)
+
+def benchCountOnes(a):
+  return lambda: a.countOnes()
+
+def benchBitDistance(a):
+  b = a.withRandomizedValue()
+  return lambda: a.bitDistance(b)
+
+def benchSlice(a):
+  (start, stop) = (a.count // 4, max(a.count // 4 + 1, 3 * a.count // 4))
+  return lambda: a[start:stop]
+
+def benchReversedSlice(a):
+  return lambda: a[::-1]
+
+def benchConcat(a):
+  pieces = a.split(64)
+  return lambda: BitwiseData.concat(pieces)
+
+def benchConvertBytes(a):
+  data = a.toBytes()
+  return lambda: BitwiseData.convertBytes(data)
+
+def benchShifts(a):
+  n = a.count // 3
+  return lambda: a.withRshift(n).withLshift(n)
+
+def benchNthOne(a):
+  if a.countOnes() == 0:  # small widths can draw all zeros; nthOne needs a one to find
+    a = a.withSetBit(a.count - 1, 1)
+  n = a.countOnes() // 2
+  return lambda: a.nthOne(n)
+
+def benchReversed(a):
+  return lambda: a.reversed()
+
+BENCHMARKS = {
+  'construct': benchConstruct,
+  'highestOneIndex': benchHighestOneIndex,
+  'countOnes': benchCountOnes,
+  'bitDistance': benchBitDistance,
+  'slice': benchSlice,
+  'reversedSlice': benchReversedSlice,
+  'concat': benchConcat,
+  'convertBytes': benchConvertBytes,
+  'shifts': benchShifts,
+  'nthOne': benchNthOne,
+  'reversed': benchReversed,
+}
+
+def runBenchmarks(names=None, widths=DEFAULT_WIDTHS, minTime=0.05, repeat=3, seed=0, log=sys.stderr):
+  """Seconds per call of each benchmark at each width, as {name: {width: seconds}}"""
+  rng = random.Random(seed)
+  results = {}
+  for width in widths:
+    a = BitwiseData.randomized(width, rng.getrandbits)
+    for name in names or BENCHMARKS:
+      seconds = timePerCall(BENCHMARKS[name](a), minTime, repeat)
+      results.setdefault(name, {})[str(width)] = seconds
+      if log:
+        print("%-16s %10d %14.9f" % (name, width, seconds), file=log)
+        log.flush()
+  return {
+    'python': platform.python_version(),
+    'implementation': platform.python_implementation(),
+    'machine': platform.machine(),
+    'results': results,
+  }
+
+def compareResults(baseline, current, threshold=1.5, log=sys.stdout):
+  """List the (name, width, ratio) cases at least threshold times slower than baseline"""
+  regressions = []
+  print("%-16s %10s %14s %14s %8s" % ("benchmark", "width", "baseline (s)", "current (s)", "ratio"), file=log)
+  for (name, widths) in sorted(current['results'].items()):
+    for (width, seconds) in sorted(widths.items(), key=lambda ws: int(ws[0])):
+      before = baseline['results'].get(name, {}).get(width)
+      if before is None:
+        continue
+      ratio = seconds / before if before > 0 else float('inf')
+      flag = "  REGRESSION" if ratio >= threshold else ""
+      print("%-16s %10s %14.9f %14.9f %8.2f%s" % (name, width, before, seconds, ratio, flag), file=log)
+      if flag:
+        regressions.append((name, int(width), ratio))
+  return regressions
+
+def benchHammingIndex(sizes, width=256, radius=8, queryCount=100, seed=0):
+  """Query time of HammingIndex against a linear scan, for growing numbers of stored codes
+
+  Queries are stored codes with a few bits flipped, the near duplicate lookups the
+  index is built for.  A sublinear index shows roughly flat per-query times while the
+  scan grows with the number of codes.
+  """
+  rng = random.Random(seed)
+  index = HammingIndex(width)
+  codes = BitwiseArray(width)
+  print("%10s %14s %14s %14s" % ("codes", "radius (ms)", "nearest (ms)", "scan (ms)"))
+  for size in sorted(sizes):
+    while len(codes) < size:
+      code = BitwiseData.randomized(width, rng.getrandbits)
+      index.insert(code)
+      codes.append(code)
+    queries = []
+    for _ in range(queryCount):
+      flips = rng.sample(range(width), rng.randrange(1, radius + 1))
+      queries.append(codes[rng.randrange(size)].withFlips(flips))
+    (radiusTime, _) = timed(lambda: [index.radius(q, radius) for q in queries])
+    (nearestTime, _) = timed(lambda: [index.nearest(q, 1) for q in queries])
+    scans = queries[:max(1, queryCount // 10)]
+    (scanTime, _) = timed(lambda: [codes.bitDistance(q) for q in scans])
+    print("%10d %14.3f %14.3f %14.3f" % (size,
+      1000 * radiusTime / len(queries), 1000 * nearestTime / len(queries), 1000 * scanTime / len(scans)))
+    sys.stdout.flush()
+
+IMPORT_PROBE = "import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)"
+
+def benchImports(modules=('binary', 'genetics', 'stats'), repeat=10, log=sys.stderr):
+  """Seconds to import each module in a fresh interpreter, as {module: {'min':, 'median':}}
+
+  Each run is a new process, as a forked worker or short CLI would be, so nothing is
+  shared between runs except the compiled bytecode cache.
+  """
+  directory = os.path.dirname(os.path.abspath(__file__))
+  results = {}
+  for module in modules:
+    times = []
+    for _ in range(repeat):
+      output = subprocess.check_output([sys.executable, "-c", IMPORT_PROBE % module], cwd=directory)
+      times.append(float(output))
+    times.sort()
+    results[module] = {'min': times[0], 'median': times[len(times) // 2]}
+    if log:
+      print("%-10s min %8.3f ms   median %8.3f ms"
+            % (module, 1000 * times[0], 1000 * times[len(times) // 2]), file=log)
+  return {
+    'python': platform.python_version(),
+    'implementation': platform.python_implementation(),
+    'machine': platform.machine(),
+    'imports': results,
+  }
+
+def addRunArguments(parser):
+  parser.add_argument("--benchmarks", nargs="+", choices=sorted(BENCHMARKS), help="default: all")
+  parser.add_argument("--widths", type=int, nargs="+", default=DEFAULT_WIDTHS)
+  parser.add_argument("--min-time", type=float, default=0.05, help="seconds per measurement")
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--seed", type=int, default=0)
+
+def run(args):
+  return runBenchmarks(args.benchmarks, args.widths, args.min_time, args.repeat, args.seed)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Benchmark binary.py")
+  commands = parser.add_subparsers(dest="command")
+  commands.required = True
+
+  runParser = commands.add_parser("run", help="time the hot paths and write JSON")
+  addRunArguments(runParser)
+  runParser.add_argument("-o", "--output", help="JSON file (default: stdout)")
+
+  compareParser = commands.add_parser("compare", help="compare against a baseline run")
+  compareParser.add_argument("baseline", help="JSON file from an earlier run")
+  compareParser.add_argument("current", nargs="?", help="JSON file to compare (default: run now)")
+  compareParser.add_argument("--threshold", type=float, default=1.5,
+                             help="flag cases at least this many times slower")
+  addRunArguments(compareParser)
+
+  hammingParser = commands.add_parser("hamming", help="HammingIndex against a linear scan")
+  hammingParser.add_argument("--sizes", type=int, nargs="+", default=[10**4, 10**5, 10**6],
+                             help="numbers of stored codes")
+  hammingParser.add_argument("--width", type=int, default=256)
+  hammingParser.add_argument("--radius", type=int, default=8)
+  hammingParser.add_argument("--queries", type=int, default=100)
+  hammingParser.add_argument("--seed", type=int, default=0)
+
+  importsParser = commands.add_parser("imports", help="cold start import time in fresh interpreters")
+  importsParser.add_argument("--modules", nargs="+", default=["binary", "genetics", "stats"])
+  importsParser.add_argument("--repeat", type=int, default=10)
+  importsParser.add_argument("--max-ms", type=float, help="exit non-zero if a median exceeds this")
+  importsParser.add_argument("-o", "--output", help="JSON file")
+
+  args = parser.parse_args()
+  if args.command == "run":
+    results = run(args)
+    if args.output:
+      with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    else:
+      json.dump(results, sys.stdout, indent=2)
+      print()
+  elif args.command == "compare":
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if args.current:
+      with open(args.current) as f:
+        current = json.load(f)
+    else:
+      if args.benchmarks is None:
+        args.benchmarks = [name for name in BENCHMARKS if name in baseline['results']]
+      current = run(args)
+    regressions = compareResults(baseline, current, args.threshold)
+    print("%d regression(s)" % len(regressions))
+    sys.exit(1 if regressions else 0)
+  elif args.command == "imports":
+    results = benchImports(args.modules, args.repeat)
+    if args.output:
+      with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.max_ms is not None:
+      slow = [m for (m, t) in results['imports'].items() if 1000 * t['median'] > args.max_ms]
+      if slow:
+        print("over %.1f ms: %s" % (args.max_ms, " ".join(slow)))
+        sys.exit(1)
+  else:
+    benchHammingIndex(args.sizes, args.width, args.radius, args.queries, args.seed)
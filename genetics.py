@@ -1,7 +1,21 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import abc
 import random
 import math
+import bisect
+import operator
+import functools
+import itertools
+import collections
+import collections.abc
+import hashlib
+import io
+import marshal
+import pickle
+from array import array
 
 """A genome is a dictionary with keys as gene names, and with values as a sequence of equally probable gene values.
 
@@ -14,9 +28,154 @@ e.g.
   """
 
 
+_numberTypes = frozenset((int, float, bool))
+_plainTypes = frozenset((int, float, str, bytes, type(None)))
+_mask64 = (1 << 64) - 1
+
+class Fingerprinter:
+  """Fixed size fingerprints of individuals, for telling duplicates apart quickly.
+
+  The gene values are taken as a tuple in one canonical key order (sorted once per genome).
+  A 64 bit fingerprint of a tuple of plain numbers is the tuple's own hash, which is not
+  randomized between runs and already equates 1, 1.0 and True, or 0.0 and -0.0.  Any other
+  tuple is serialized with marshal (version 2, which writes equal values as equal bytes),
+  or pickled without the memo if marshal cannot write it, and hashed with blake2b to 64 or
+  128 bits.  Fingerprints are stable between runs and processes of one Python build, so
+  they can key a saved FitnessCache.
+
+  Before serializing, numbers that compare equal are made alike (True and 1.0 become 1,
+  -0.0 becomes 0, also inside tuples and lists), so {"a": 1, "b": "x"} and
+  {"a": 1.0, "b": "x"} are one individual as they are one dict; tuples needing no change,
+  the usual case, are left as they are.  Other values are told apart by their bytes: equal
+  values that serialize differently, such as sets or dicts built in different orders, are
+  distinct.
+  """
+  def __init__(self, genome=None, bits=64):
+    if bits not in (64, 128):
+      raise ValueError("fingerprints are 64 or 128 bits, not %r" % (bits,))
+    self.bits = bits
+    self.keys = None if genome is None else self._canonical(genome)
+
+  @staticmethod
+  def _canonical(keys):
+    try:
+      return sorted(keys)
+    except TypeError:
+      return sorted(keys, key=repr)
+
+  @staticmethod
+  def _normalized(value):
+    t = type(value)
+    if t == float:
+      return int(value) if value.is_integer() else value
+    if t == bool:
+      return int(value)
+    if t == tuple or t == list:
+      return t(map(Fingerprinter._normalized, value))
+    return value
+
+  @staticmethod
+  def _dumps(values):
+    try:
+      return marshal.dumps(values, 2)
+    except ValueError:  # types marshal does not write
+      buffer = io.BytesIO()
+      pickler = pickle.Pickler(buffer, 4)
+      pickler.fast = True
+      try:
+        pickler.dump(values)
+      except (pickle.PicklingError, AttributeError) as e:
+        raise TypeError("cannot fingerprint gene values: %s" % e)
+      return buffer.getvalue()
+
+  def fingerprint(self, individual):
+    """The fingerprint of a mapping of gene values, cached on an Individual."""
+    isIndividual = type(individual) == Individual
+    if isIndividual and individual.fingerprinter is self and individual.fingerprint is not None:
+      return individual.fingerprint
+    if self.keys is None:
+      self.keys = self._canonical(individual)
+    try:
+      values = tuple(map(individual.__getitem__, self.keys))
+      if len(individual) != len(self.keys):
+        raise KeyError
+    except KeyError:  # not the genome's genes; name them all
+      keys = self._canonical(individual)
+      values = tuple(zip(keys, map(individual.__getitem__, keys)))
+    kinds = set(map(type, values))
+    if self.bits == 64 and kinds <= _numberTypes:
+      h = hash(values) & _mask64
+    else:
+      if not kinds <= _plainTypes or (float in kinds and
+                                      any(map(float.is_integer, filter(float.__instancecheck__, values)))):
+        values = tuple(map(self._normalized, values))
+      h = int.from_bytes(hashlib.blake2b(self._dumps(values), digest_size=self.bits // 8).digest(), 'little')
+    if isIndividual:
+      individual.fingerprinter = self
+      individual.fingerprint = h
+    return h
+
+class Individual(dict):
+  """A dict of gene values that remembers its fingerprint until a gene changes."""
+  __slots__ = ("fingerprinter", "fingerprint")
+
+  def __init__(self, *args, **kwargs):
+    dict.__init__(self, *args, **kwargs)
+    self.fingerprinter = None
+    self.fingerprint = None
+
+  def __setitem__(self, key, value):
+    self.fingerprint = None
+    dict.__setitem__(self, key, value)
+
+  def _changed(self):
+    self.fingerprint = None
+
+  def __delitem__(self, key):
+    self._changed()
+    dict.__delitem__(self, key)
+  def pop(self, *args):
+    self._changed()
+    return dict.pop(self, *args)
+  def popitem(self):
+    self._changed()
+    return dict.popitem(self)
+  def clear(self):
+    self._changed()
+    dict.clear(self)
+  def update(self, *args, **kwargs):
+    self._changed()
+    dict.update(self, *args, **kwargs)
+  def setdefault(self, key, default=None):
+    self._changed()
+    return dict.setdefault(self, key, default)
+  def __ior__(self, other):
+    self.update(other)
+    return self
+
+  def copy(self):
+    return Individual(self)
+
+  def __reduce__(self):
+    # the cached fingerprint stays behind
+    return (Individual, (dict(self),))
+
+class _ExactKey:
+  """A fingerprint that also compares the genes themselves, for Population(exactCompare=True)."""
+  __slots__ = ("fingerprint", "genes")
+  def __init__(self, fingerprint, genes):
+    self.fingerprint = fingerprint
+    self.genes = dict(genes)
+  def __hash__(self):
+    return hash(self.fingerprint)
+  def __eq__(self, other):
+    return type(other) == _ExactKey and self.fingerprint == other.fingerprint and self.genes == other.genes
+  def __reduce__(self):
+    return (_ExactKey, (self.fingerprint, self.genes))
+
 def roll(genome, random=random):
     """Randomly produce a set of genes based on the given genome."""
-    genes = {}
+    genes = Individual()
     for (geneName, gene) in genome.items():
       if hasattr(gene,"roll"):
         genes[geneName] = gene.roll()
@@ -26,7 +185,7 @@ def roll(genome, random=random):
 
 def cross(a, b, random=random):
     """Create a new set of genes.  Each gene is randomly selected from one of the parents."""
-    return { key : random.choice([a,b])[key] for key in a.keys() }
+    return Individual((key, random.choice([a,b])[key]) for key in a.keys())
 
 def roulette_index(n, random=random):
     """Randomly choose an index from 0...n-1.  Choice has a weight of (index+1)."""
@@ -37,6 +196,43 @@ def roulette(population, random=random):
     """Randomly select an individual from the population, weighted by (index+1)."""
     return population[roulette_index(len(population), random)]
 
+_reverseIndexes = collections.OrderedDict()  # id(gene) -> (gene, {value: index}), recently used last
+_reverseIndexLimit = 1 << 20  # values, summed over the cached tuples
+_reverseIndexSize = 0
+
+def geneIndex(gene, value):
+    """Return the index of value in gene, as gene.index(value) but without scanning tuples.
+
+    Sequences, FloatRange and range compute their index() directly.  For a tuple the map of
+    values to (first) indices is built once and kept while the most recently used tuples
+    hold no more than _reverseIndexLimit values between them.
+    """
+    global _reverseIndexSize
+    if type(gene) != tuple:
+      return gene.index(value)
+    entry = _reverseIndexes.get(id(gene))
+    if entry is None or entry[0] is not gene:
+      reverse = {}
+      try:
+        for (i, v) in enumerate(gene):
+          reverse.setdefault(v, i)
+      except TypeError:  # unhashable values
+        return gene.index(value)
+      if entry is not None:
+        _reverseIndexSize -= len(entry[0])
+      entry = (gene, reverse)
+      _reverseIndexes[id(gene)] = entry
+      _reverseIndexSize += len(gene)
+      while _reverseIndexSize > _reverseIndexLimit and len(_reverseIndexes) > 1:
+        (old, _) = _reverseIndexes.popitem(last=False)[1]
+        _reverseIndexSize -= len(old)
+    else:
+      _reverseIndexes.move_to_end(id(gene))
+    try:
+      return entry[1][value]
+    except (KeyError, TypeError):
+      return gene.index(value)
+
 def mutate(a, genome, keyProbability=None, random=random, roulette=True):
     """Randomly change each gene with probability keyProbability.
 
@@ -54,7 +250,7 @@ def mutate(a, genome, keyProbability=None, random=random, roulette=True):
           a[key] = genome[key].mutate(a[key])
         else:
           originalValue = a[key]
-          originalIndex = genome[key].index(originalValue)
+          originalIndex = geneIndex(genome[key], originalValue)
           if roulette:
             delta = roulette_index(len(genome[key]), random)
             if random.random() < 0.5:
@@ -76,36 +272,526 @@ def equals(a,b):
         return False
     return True 
 
+class Encoding:
+  """Numbers the values of each gene so that an individual is a row of gene indices.
+
+  The genome's genes must be indexable sequences (tuples, Sequence), not Gene objects.
+  Rows are array('I'), one field per gene in the genome's key order.  Whole rows are
+  crossed as integers: a random bit per field, (r << FIELD_BITS) - r, widens each bit
+  into a field mask that picks every gene of the child from one parent or the other.
+  """
+  FIELD_BITS = 8 * array('I').itemsize
+
+  def __init__(self, genome):
+    for (key, gene) in genome.items():
+      if not hasattr(gene, "__getitem__"):
+        raise TypeError("gene %r is not an indexable sequence of values" % (key,))
+    self.genome = genome
+    self.keys = list(genome.keys())
+    self.positions = { key : i for (i, key) in enumerate(self.keys) }
+    self.sizes = [len(genome[key]) for key in self.keys]
+    self.geneCount = len(self.keys)
+    self.lowBits = sum(1 << (Encoding.FIELD_BITS * i) for i in range(self.geneCount))
+
+  def encode(self, individual):
+    """The row of gene indices of a dict (or any mapping) of gene values."""
+    if type(individual) == GenotypeView and individual.genotypes.encoding is self:
+      return individual.indices
+    return array('I', [geneIndex(self.genome[key], individual[key]) for key in self.keys])
+
+  def decode(self, row):
+    """The dict of gene values of a row."""
+    return { key : self.genome[key][i] for (key, i) in zip(self.keys, row) }
+
+  def _toInt(self, row):
+    return int.from_bytes(row.tobytes(), sys.byteorder)
+
+  def _fromInt(self, value):
+    row = array('I')
+    row.frombytes(value.to_bytes(self.geneCount * row.itemsize, sys.byteorder))
+    return row
+
+  def roll(self, random=random):
+    """A random row, each gene uniformly chosen (one getrandbits call per row)."""
+    if not self.geneCount:
+      return array('I')
+    words = array('Q')
+    words.frombytes(random.getrandbits(64 * self.geneCount).to_bytes(8 * self.geneCount, sys.byteorder))
+    return array('I', [(w * n) >> 64 for (w, n) in zip(words, self.sizes)])
+
+  def cross(self, a, b, random=random):
+    """A child row taking each gene from row a or row b with equal probability."""
+    if not self.geneCount:
+      return array('I')
+    r = random.getrandbits(Encoding.FIELD_BITS * self.geneCount) & self.lowBits
+    mask = (r << Encoding.FIELD_BITS) - r
+    (x, y) = (self._toInt(a), self._toInt(b))
+    return self._fromInt(y ^ ((x ^ y) & mask))
+
+  def mutate(self, row, keyProbability=None, random=random):
+    """A copy of row with each gene mutated with probability keyProbability, as mutate does.
+
+    The mutated genes are found by geometric skips, one random draw per mutation rather
+    than one per gene, and each moves a roulette distance up or down its gene.
+    """
+    row = array('I', row)
+    if keyProbability is None:
+      keyProbability = 1 / max(self.geneCount, 1)
+    if keyProbability <= 0:
+      return row
+    logMiss = math.log(1 - keyProbability) if keyProbability < 1 else None
+    i = -1
+    while True:
+      i += 1
+      if logMiss is not None:
+        i += int(math.log(1 - random.random()) / logMiss)
+      if i >= self.geneCount:
+        return row
+      n = self.sizes[i]
+      delta = roulette_index(n, random)
+      if random.random() < 0.5:
+        row[i] = (row[i] + delta) % n
+      else:
+        row[i] = (row[i] - delta) % n
+
+class GenotypeArray:
+  """Many rows of one Encoding, stored as a single flat array('I') (a 2-D array of indices)."""
+  def __init__(self, encoding, indices=None):
+    self.encoding = encoding
+    self.indices = array('I') if indices is None else array('I', indices)
+
+  def __len__(self):
+    return len(self.indices) // max(self.encoding.geneCount, 1)
+
+  def row(self, i):
+    n = self.encoding.geneCount
+    return self.indices[i * n : (i + 1) * n]
+
+  def __getitem__(self, i):
+    """A GenotypeView of row i, which decodes genes only as they are read."""
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError("GenotypeArray row %d out of range" % i)
+    return GenotypeView(self, i)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield GenotypeView(self, i)
+
+  def append(self, row):
+    """Add a row (or a dict of gene values), returning its view."""
+    if type(row) != array:
+      row = self.encoding.encode(row)
+    if len(row) != self.encoding.geneCount:
+      raise ValueError("row has %d genes, expected %d" % (len(row), self.encoding.geneCount))
+    self.indices.extend(row)
+    return GenotypeView(self, len(self) - 1)
+
+  def setRow(self, i, row):
+    """Overwrite row i with a row (or a dict of gene values), returning its view."""
+    if not 0 <= i < len(self):
+      raise IndexError("GenotypeArray row %d out of range" % i)
+    if type(row) != array:
+      row = self.encoding.encode(row)
+    n = self.encoding.geneCount
+    if len(row) != n:
+      raise ValueError("row has %d genes, expected %d" % (len(row), n))
+    self.indices[i * n : (i + 1) * n] = row
+    return GenotypeView(self, i)
+
+  @staticmethod
+  def rolled(encoding, count, random=random):
+    result = GenotypeArray(encoding)
+    for _ in range(count):
+      result.indices.extend(encoding.roll(random))
+    return result
+
+  def toList(self):
+    """The rows as dicts of gene values."""
+    return [self.encoding.decode(self.row(i)) for i in range(len(self))]
+
+class GenotypeView(collections.abc.Mapping):
+  """A read only mapping of gene names to values, over one row of a GenotypeArray."""
+  __slots__ = ("genotypes", "rowIndex")
+
+  def __init__(self, genotypes, rowIndex):
+    self.genotypes = genotypes
+    self.rowIndex = rowIndex
+
+  @property
+  def indices(self):
+    return self.genotypes.row(self.rowIndex)
+
+  def __getitem__(self, key):
+    encoding = self.genotypes.encoding
+    position = encoding.positions[key]
+    return encoding.genome[key][self.genotypes.indices[self.rowIndex * encoding.geneCount + position]]
+
+  def __iter__(self):
+    return iter(self.genotypes.encoding.keys)
+
+  def __len__(self):
+    return self.genotypes.encoding.geneCount
+
+  def __eq__(self, other):
+    if type(other) == GenotypeView and other.genotypes.encoding is self.genotypes.encoding:
+      return other.indices == self.indices
+    return collections.abc.Mapping.__eq__(self, other)
+
+  __hash__ = None
+
+  def __reduce__(self):
+    # sent to worker processes as a plain dict rather than with the whole array
+    return (dict, (dict(self),))
+
+  def __repr__(self):
+    return repr(dict(self))
+
+def _isCoroutineFunction(f):
+    import asyncio
+    while isinstance(f, functools.partial):
+      f = f.func
+    return asyncio.iscoroutinefunction(f) or asyncio.iscoroutinefunction(getattr(f, "__call__", None))
+
+def createExecutor(kind="serial", workers=None):
+    """Return an executor for Population scoring: None (serial), or a thread or process pool.
+
+    Any object with map(function, iterable, chunksize=n) can be used instead, such as a
+    multiprocessing.Pool.  The caller owns the pool and should shut it down when done.
+    A process pool needs a scoring function that can be pickled (defined at module level).
+    """
+    if kind == "serial":
+      return None
+    import concurrent.futures
+    if kind == "thread":
+      return concurrent.futures.ThreadPoolExecutor(workers)
+    if kind == "process":
+      return concurrent.futures.ProcessPoolExecutor(workers)
+    raise ValueError("unknown executor kind %r" % (kind,))
+
+class FitnessCache:
+  """A map from individuals (by Population.hash) to their scores, kept across generations.
+
+  maxsize - entries kept before evicting, None for no limit
+  policy - "lru" evicts the least recently used score, "lfu" the least often used
+           (oldest first among equals)
+  path - a file the cache is loaded from, if it exists, and saved to by save()
+
+  Scores are only reusable if the scoring function always gives the same score to the
+  same individual.
+  """
+  def __init__(self, maxsize=None, policy="lru", path=None):
+    if policy not in ("lru", "lfu"):
+      raise ValueError("unknown cache policy %r" % (policy,))
+    self.maxsize = maxsize
+    self.policy = policy
+    self.path = path
+    self.scores = collections.OrderedDict()  # key -> score, least recently used first
+    self.frequencies = {}  # key -> uses, for lfu
+    self.buckets = {}  # uses -> OrderedDict of keys with that many uses, for lfu
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    if path is not None and os.path.exists(path):
+      self.load(path)
+
+  def __len__(self):
+    return len(self.scores)
+
+  def __contains__(self, key):
+    return key in self.scores
+
+  def get(self, key, default=None):
+    """Return the cached score for key, counting a hit or a miss."""
+    if key not in self.scores:
+      self.misses += 1
+      return default
+    self.hits += 1
+    self._touch(key)
+    return self.scores[key]
+
+  def put(self, key, score, uses=1):
+    """Store a score, evicting another if the cache is full."""
+    if key in self.scores:
+      self.scores[key] = score
+      self._touch(key)
+      return
+    if self.maxsize is not None:
+      if self.maxsize <= 0:
+        return
+      while len(self.scores) >= self.maxsize:
+        self._evictOne()
+    self.scores[key] = score
+    if self.policy == "lfu":
+      self.frequencies[key] = uses
+      self.buckets.setdefault(uses, collections.OrderedDict())[key] = None
+
+  def _touch(self, key):
+    if self.policy == "lru":
+      self.scores.move_to_end(key)
+      return
+    uses = self.frequencies[key]
+    bucket = self.buckets[uses]
+    del bucket[key]
+    if not bucket:
+      del self.buckets[uses]
+    self.frequencies[key] = uses + 1
+    self.buckets.setdefault(uses + 1, collections.OrderedDict())[key] = None
+
+  def _evictOne(self):
+    if self.policy == "lru":
+      self.scores.popitem(last=False)
+    else:
+      uses = min(self.buckets)
+      bucket = self.buckets[uses]
+      (key, _) = bucket.popitem(last=False)
+      if not bucket:
+        del self.buckets[uses]
+      del self.frequencies[key]
+      del self.scores[key]
+    self.evictions += 1
+
+  def resize(self, maxsize):
+    self.maxsize = maxsize
+    while maxsize is not None and len(self.scores) > max(maxsize, 0):
+      self._evictOne()
+
+  def clear(self):
+    self.scores.clear()
+    self.frequencies.clear()
+    self.buckets.clear()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def info(self):
+    return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'size': len(self.scores), 'maxsize': self.maxsize, 'policy': self.policy}
+
+  def save(self, path=None):
+    """Write the entries (not the statistics) to path, or to the cache's own path."""
+    path = path or self.path
+    if path is None:
+      raise ValueError("no path to save to")
+    entries = [(key, score, self.frequencies.get(key, 1)) for (key, score) in self.scores.items()]
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+      pickle.dump({"version": 1, "entries": entries}, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+  def load(self, path=None):
+    """Add the entries saved in path, or in the cache's own path."""
+    with open(path or self.path, "rb") as f:
+      saved = pickle.load(f)
+    for (key, score, uses) in saved["entries"]:
+      self.put(key, score, uses)
+
+class Selection(abc.ABC):
+  """Chooses parents from a population of (individual, score) tuples sorted by increasing score.
+
+  prepare() does the per generation work once; select() then draws one parent, and pair()
+  two different ones, in O(1) or O(log n) without copying the population.  The parents
+  are pool[start:], the last poolSize tuples of the population list itself.
+  """
+  def prepare(self, population, maxParents=None):
+    """Take the best maxParents of a sorted population as the pool of parents."""
+    self.pool = population
+    self.start = max(len(population) - maxParents, 0) if maxParents else 0
+    self.poolSize = len(population) - self.start
+    return self
+
+  @abc.abstractmethod
+  def select(self, random=random):
+    """One parent from the pool."""
+
+  def pair(self, random=random):
+    """Two parents that are not equal individuals."""
+    a = self.select(random)
+    b = self.select(random)
+    while (equals(a,b)):
+      b = self.select(random)
+    return (a, b)
+
+  def pairs(self, count, random=random):
+    """count pairs of unequal parents in one call, each drawn as pair draws it."""
+    pair = self.pair
+    return [pair(random) for i in range(count)]  # @UnusedVariable
+
+class RankRoulette(Selection):
+  """Parents weighted by rank, (index+1) in increasing score order, as roulette chooses them."""
+  def select(self, random=random):
+    return self.pool[self.start + roulette_index(self.poolSize, random)][0]
+
+class Tournament(Selection):
+  """The best of size parents drawn uniformly at random."""
+  def __init__(self, size=2):
+    self.size = size
+
+  def select(self, random=random):
+    best = max(random.randrange(self.poolSize) for i in range(self.size))  # @UnusedVariable
+    return self.pool[self.start + best][0]
+
+class FitnessProportional(Selection):
+  """Parents weighted by how far their score is above the lowest score in the pool.
+
+  weight - maps a score to a non-negative weight, instead of the distance above the lowest.
+  If every weight is zero, parents are chosen uniformly.
+  """
+  def __init__(self, weight=None):
+    self.weight = weight
+
+  def prepare(self, population, maxParents=None):
+    Selection.prepare(self, population, maxParents)
+    scores = [self.pool[i][1] for i in range(self.start, len(self.pool))]
+    if self.weight is None:
+      lowest = min(scores) if scores else 0
+      weights = [score - lowest for score in scores]
+    else:
+      weights = [self.weight(score) for score in scores]
+    self.cumulative = list(itertools.accumulate(weights))
+    self.total = self.cumulative[-1] if self.cumulative else 0
+    return self
+
+  def select(self, random=random):
+    if self.total <= 0:
+      return self.pool[self.start + random.randrange(self.poolSize)][0]
+    i = bisect.bisect_right(self.cumulative, random.random() * self.total)
+    return self.pool[self.start + min(i, self.poolSize - 1)][0]
+
 class Population:
   """Encapsulate a set of individuals that can be evolved according to a scoring function."""
 
-  def __init__(self, genome, scoringFunction, random=random):
-    """Initialize the parameters for the population."""
+  def __init__(self, genome, scoringFunction, random=random, executor=None, chunkSize=1, cache=None,
+               encoding=None, fingerprinter=None, exactCompare=False, batchScoringFunction=None,
+               columnar=False):
+    """Initialize the parameters for the population.
+
+    scoringFunction - scores one individual; may be None when there is a batchScoringFunction
+
+    executor - scores batches of individuals concurrently (see createExecutor); None scores serially
+    chunkSize - individuals sent to a worker at a time, for process pools and slow scoring functions
+    cache - a FitnessCache shared by the generations evolve creates, so that no distinct
+            individual is scored twice while it stays in the cache
+    encoding - an Encoding of the genome: individuals are then stored as rows of one
+               GenotypeArray, bred row-at-a-time, and scored as GenotypeView mappings
+    fingerprinter - the Fingerprinter identifying duplicate individuals (and FitnessCache
+                    entries), shared with the generations evolve creates
+    exactCompare - also compare the genes of individuals whose fingerprints match
+    batchScoringFunction - scores a whole batch (such as a generation) in one call, returning a
+                           sequence or array of scores in order.  It is called in this process
+                           with the list of individuals, or with columnar, a dict of each gene
+                           name to the list of that gene's values
+    """
+    if scoringFunction is None and batchScoringFunction is None:
+      raise ValueError("Population needs a scoringFunction or a batchScoringFunction")
     self.population = [] # a list of (indiviudal, score) tuples
     self.individuals = set()
     self.genome = genome
     self.scoringFunction = scoringFunction
     self.isSorted = True
     self.random = random
+    self.executor = executor
+    self.chunkSize = chunkSize
+    self.cache = cache
+    self.encoding = encoding
+    self.genotypes = None if encoding is None else GenotypeArray(encoding)
+    self.fingerprinter = Fingerprinter(genome) if fingerprinter is None else fingerprinter
+    self.exactCompare = exactCompare
+    self.batchScoringFunction = batchScoringFunction
+    self.columnar = columnar
 
   def sort(self):
     """Sort the population by increasing score."""
     if self.isSorted:
       return
-    self.population.sort(key = lambda r:r[1])  # ascending order, by score
+    self.population.sort(key = operator.itemgetter(1))  # ascending order, by score
     self.isSorted = True
 
   def score(self, individual):
     """Calculate the score for the given individual."""
-    return (individual, self.scoringFunction(individual))
+    if self.cache is None:
+      return (individual, self._scoreOne(individual))
+    return self.scoreAll([individual])[0]
+
+  def _scoreOne(self, individual):
+    if self.scoringFunction is not None:
+      return self.scoringFunction(individual)
+    return self._batchScores([individual])[0]
+
+  def _batchScores(self, individuals):
+    if not individuals:
+      return []
+    if self.columnar:
+      batch = { key : [individual[key] for individual in individuals] for key in self.genome }
+    else:
+      batch = individuals
+    scores = list(self.batchScoringFunction(batch))
+    if len(scores) != len(individuals):
+      raise ValueError("batchScoringFunction returned %d scores for %d individuals"
+                       % (len(scores), len(individuals)))
+    return scores
+
+  def scoreAll(self, individuals):
+    """Calculate the scores for many individuals, through the executor if there is one.
+
+    With a cache, only individuals missing from it are scored, each distinct one once.
+    """
+    individuals = list(individuals)
+    if self.cache is None:
+      return list(zip(individuals, self._scores(individuals)))
+    keys = [self.hash(individual) for individual in individuals]
+    missing = object()
+    scores = []
+    pending = collections.OrderedDict()  # key -> individual, distinct misses in order
+    for (key, individual) in zip(keys, individuals):
+      score = missing if key in pending else self.cache.get(key, missing)
+      if score is missing:
+        pending.setdefault(key, individual)
+      scores.append(score)
+    for (key, score) in zip(pending, self._scores(list(pending.values()))):
+      pending[key] = score
+      self.cache.put(key, score)
+    return [(individual, pending[key] if score is missing else score)
+            for (key, individual, score) in zip(keys, individuals, scores)]
+
+  def _scores(self, individuals):
+    if self.batchScoringFunction is not None:
+      return self._batchScores(individuals)
+    if self.executor is None:
+      return map(self.scoringFunction, individuals)
+    return self.executor.map(self.scoringFunction, individuals, chunksize=self.chunkSize)
 
   def addRandomIndividuals(self, n):
     """Add n new random individuals to the population."""
-    for i in range(n):  # @UnusedVariable
-      self.addIndividual(roll(self.genome, self.random))
+    if self.encoding is None:
+      self.addIndividuals([roll(self.genome, self.random) for i in range(n)])  # @UnusedVariable
+    else:
+      self.addIndividuals([self.encoding.roll(self.random) for i in range(n)])  # @UnusedVariable
+
+  def _member(self, individual):
+    """With an encoding, store the individual (dict, view or row) as a row of this population."""
+    if self.encoding is None:
+      return individual
+    return self.genotypes.append(individual)
+
+  def addIndividuals(self, individuals):
+    """Add many individuals, scoring them as one batch."""
+    for newMember in self.scoreAll([self._member(individual) for individual in individuals]):
+      self.population.append(newMember)
+      self.individuals.add(self.hash(newMember[0]))
+    self.isSorted = False
+
+  def addScoredIndividuals(self, members):
+    """Add (individual, score) tuples without scoring them again."""
+    for (individual, score) in members:
+      self.population.append((self._member(individual), score))
+      self.individuals.add(self.hash(individual))
+    self.isSorted = False
 
   def addIndividual(self, individual, score=None):
     """Add a single individual to the population."""
+    individual = self._member(individual)
     if score:
       newMember = (individual, score)
     else:
@@ -114,12 +800,32 @@ class Population:
     self.individuals.add(self.hash(individual))
     self.isSorted = False
 
+  def _mergeSorted(self, count):
+    """Sort a population whose first count members are already in order.
+
+    Only the rest are sorted; the others are then inserted among them by binary search, in
+    the order a stable sort of the whole population would give.
+    """
+    members = sorted(self.population[count:], key=operator.itemgetter(1))
+    scores = [score for (individual, score) in members]  # @UnusedVariable
+    for member in reversed(self.population[:count]):
+      i = bisect.bisect_left(scores, member[1])
+      members.insert(i, member)
+      scores.insert(i, member[1])
+    self.population = members
+    self.isSorted = True
+
   def __len__(self):
     """Return the number of individuals in the population."""
     return len(self.population)
 
   def hash(self, individual):
-    return tuple(sorted(individual.items()))
+    if self.encoding is not None:
+      return (individual if type(individual) == array else self.encoding.encode(individual)).tobytes()
+    fingerprint = self.fingerprinter.fingerprint(individual)
+    if self.exactCompare:
+      return _ExactKey(fingerprint, individual)
+    return fingerprint
 
   def __contains__(self, individual):
     """Return true if the given individual exists in the population."""
@@ -130,30 +836,289 @@ class Population:
     self.population = list(other.population)
     self.individuals = set(other.individuals)
     self.isSorted = other.isSorted
+    self.genotypes = other.genotypes
+
+  def evolve(self, elitism=0, mutation=None, maxParents=None, individualAdjustmentFunction=None,
+             selection=None):
+    """Create a new generation of individuals using cross breeding, mutation and elitism.
 
-  def evolve(self, elitism=0, mutation=None, maxParents=None, individualAdjustmentFunction=None):
-    """Create a new generation of individuals using cross breeding, mutation and elitism."""
+    selection - a Selection choosing the parents, RankRoulette (roulette) by default
+
+    The parents of all the children still needed are drawn as one batch of pairs (and again
+    for any duplicates), then the children are bred and scored as one batch.  Which children
+    are kept depends only on the random draws and on duplicates, never on scores, so the new
+    generation is the same whichever executor does the scoring.
+    """
     self.sort()
     if maxParents is None:
       maxParents = len(self)
-    newPopulation = Population(self.genome, self.scoringFunction, self.random)
+    if selection is None:
+      selection = RankRoulette()
+    selection.prepare(self.population, maxParents)
+    newPopulation = Population(self.genome, self.scoringFunction, self.random,
+                               self.executor, self.chunkSize, self.cache, self.encoding,
+                               self.fingerprinter, self.exactCompare, self.batchScoringFunction,
+                               self.columnar)
     for elite in self.population[-elitism:]:
       newPopulation.addIndividual(*elite)
-    while len(newPopulation) < self.__len__():
-      a = roulette(self.population[-maxParents:], self.random)[0]
-      b = roulette(self.population[-maxParents:], self.random)[0]
-      while (equals(a,b)):
-        b = roulette(self.population[-maxParents:], self.random)[0]
-      c = cross(a,b)
+    eliteCount = len(newPopulation)
+    children = []
+    childHashes = set()
+    while len(newPopulation) + len(children) < self.__len__():
+      needed = self.__len__() - len(newPopulation) - len(children)
+      for parents in selection.pairs(needed, self.random):
+        c = self._breed(parents, mutation, individualAdjustmentFunction)
+        h = self.hash(c)
+        if not (h in childHashes or h in newPopulation.individuals or h in self.individuals):
+          children.append(c)
+          childHashes.add(h)
+    newPopulation.addIndividuals(children)
+    newPopulation._mergeSorted(eliteCount)
+    self.copyPopulationFrom(newPopulation)
+
+  def _breed(self, parents, mutation, individualAdjustmentFunction):
+    """One child of a pair of parents."""
+    (a, b) = parents
+    if self.encoding is None:
+      c = cross(a,b,self.random)
       if mutation and (self.random.random() < mutation):
         mutate(c, self.genome, mutation, self.random)
       if not individualAdjustmentFunction is None:
         c = individualAdjustmentFunction(c)
-      if not (c in newPopulation or self.__contains__(c)):
-        newPopulation.addIndividual(c)
-    self.copyPopulationFrom(newPopulation)
+    else:
+      c = self.encoding.cross(a.indices, b.indices, self.random)
+      if mutation and (self.random.random() < mutation):
+        c = self.encoding.mutate(c, mutation, self.random)
+      if not individualAdjustmentFunction is None:
+        c = self.encoding.encode(individualAdjustmentFunction(self.encoding.decode(c)))
+    return c
+
+  async def evolveAsync(self, evaluations, concurrency=8, timeout=None, mutation=None, maxParents=None,
+                        individualAdjustmentFunction=None, selection=None, populationSize=None):
+    """Steady state evolution, with up to concurrency children being scored at once.
+
+    Whenever a score comes back the child replaces the worst individual, and a new child
+    is bred from the population as it is then, so one slow evaluation holds up only its own
+    slot.  Until the population reaches populationSize (if given) random individuals are
+    added instead.  evaluations children are bred in all.
+
+    Children are scored one at a time, by the batch scoring function if there is no other.
+    A coroutine scoring function (for sockets or subprocesses) is awaited; any other runs
+    in the population's executor (a concurrent.futures executor, or the event loop's
+    default thread pool).  An evaluation still running after timeout seconds is cancelled
+    and its child dropped; a thread already running a plain function cannot be stopped, so
+    it runs on.  Cancelling the coroutine cancels every evaluation in flight.  Completion
+    order, and so the result, varies from run to run.
+
+    The population is kept sorted as children arrive, and the selection is prepared again
+    only after it changes.  With an encoding, children in flight are bare rows (scored as
+    GenotypeView mappings of their own), and a child that replaces the worst individual
+    takes over its row of the GenotypeArray, so the array stays the size of the population;
+    a view of an evicted individual shows whatever replaced it.
+
+    Returns counts of the children bred, scored, found in the cache and timed out.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    scoringFunction = self._scoreOne if self.scoringFunction is None else self.scoringFunction
+    isCoroutine = _isCoroutineFunction(scoringFunction)
+    size = max(len(self), populationSize or 0)
+    if size < 2:
+      raise ValueError("steady state evolution needs a population of at least 2")
+    if selection is None:
+      selection = RankRoulette()
+    stats = {'bred': 0, 'scored': 0, 'cached': 0, 'timeouts': 0}
+    inFlight = {}  # task -> (child, hash)
+    inFlightHashes = set()
+    self.sort()
+    scores = [score for (individual, score) in self.population]  # @UnusedVariable
+    prepared = False
+
+    async def evaluate(child):
+      if self.encoding is not None:
+        child = GenotypeView(GenotypeArray(self.encoding, child), 0)
+      if isCoroutine:
+        scoring = scoringFunction(child)
+      else:
+        scoring = loop.run_in_executor(self.executor, scoringFunction, child)
+      if timeout is None:
+        return await scoring
+      return await asyncio.wait_for(scoring, timeout)
+
+    def breed():
+      nonlocal prepared
+      for attempt in range(100):  # @UnusedVariable
+        if len(self) + len(inFlight) < size or len(self) < 2:
+          c = self.encoding.roll(self.random) if self.encoding else roll(self.genome, self.random)
+        else:
+          if not prepared:
+            selection.prepare(self.population, maxParents)
+            prepared = True
+          c = self._breed(selection.pair(self.random), mutation, individualAdjustmentFunction)
+        h = self.hash(c)
+        if not (h in self.individuals or h in inFlightHashes):
+          return (c, h)
+      return (None, None)  # nothing new among the last 100 children
+
+    def insert(child, h, score):
+      nonlocal prepared
+      worst = None
+      if len(self) >= size:
+        (worst, _) = self.population.pop(0)
+        scores.pop(0)
+        self.individuals.discard(self.hash(worst))
+      if type(worst) == GenotypeView and worst.genotypes is self.genotypes:
+        member = self.genotypes.setRow(worst.rowIndex, child)
+      else:
+        member = self._member(child)
+      i = bisect.bisect_right(scores, score)
+      self.population.insert(i, (member, score))
+      scores.insert(i, score)
+      self.individuals.add(h)
+      prepared = False
+
+    missing = object()
+    try:
+      while True:
+        while len(inFlight) < concurrency and stats['bred'] < evaluations:
+          (child, h) = breed()
+          if child is None:
+            break
+          stats['bred'] += 1
+          score = missing if self.cache is None else self.cache.get(h, missing)
+          if score is not missing:
+            stats['cached'] += 1
+            insert(child, h, score)
+            continue
+          inFlight[asyncio.ensure_future(evaluate(child))] = (child, h)
+          inFlightHashes.add(h)
+        if not inFlight:
+          break
+        (done, _) = await asyncio.wait(list(inFlight), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          (child, h) = inFlight.pop(task)
+          inFlightHashes.discard(h)
+          try:
+            score = task.result()
+          except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+            continue
+          stats['scored'] += 1
+          if self.cache is not None:
+            self.cache.put(h, score)
+          insert(child, h, score)
+    finally:
+      for task in inFlight:
+        task.cancel()
+      if inFlight:
+        await asyncio.wait(list(inFlight))
+    return stats
+
+  def evolveSteadyState(self, evaluations, **kwargs):
+    """Run evolveAsync to completion in a new event loop."""
+    import asyncio
+    return asyncio.run(self.evolveAsync(evaluations, **kwargs))
 
 
+def _evolveIsland(task):
+    """Run one island for some generations (in a worker process); returns its members and random state."""
+    (genome, scoringFunction, encoding, members, randomState, size, generations, evolveArguments) = task
+    randomizer = random.Random()
+    randomizer.setstate(randomState)
+    island = Population(genome, scoringFunction, randomizer, encoding=encoding)
+    island.addScoredIndividuals(members)
+    if len(island) < size:
+      island.addRandomIndividuals(size - len(island))
+    for generation in range(generations):  # @UnusedVariable
+      island.evolve(**evolveArguments)
+    island.sort()
+    return ([(dict(individual), score) for (individual, score) in island.population], randomizer.getstate())
+
+class IslandModel:
+  """Evolve several populations (islands) side by side, moving their best individuals between them.
+
+  Every migrationInterval generations, each island sends copies of its migrantCount best
+  individuals to the islands topology names, where they replace the worst.  topology is
+  "ring" (island i sends to i+1), "complete" (to every other island), a list giving the
+  destinations of each island, or a function (i, islandCount) -> destinations.
+
+  The islands of one epoch are evolved through executor.map, so a process pool (see
+  createExecutor) runs them on separate cores; the scoring function, the genome and any
+  evolve arguments must then be picklable.  Each island has its own random.Random seeded
+  from the master seed and carried between epochs with getstate/setstate, and migration
+  happens in island order, so a run gives the same result with any executor.
+  """
+  def __init__(self, genome, scoringFunction, islandCount=4, islandSize=100, seed=0, topology="ring",
+               migrationInterval=10, migrantCount=2, executor=None, encoding=None, **evolveArguments):
+    self.genome = genome
+    self.scoringFunction = scoringFunction
+    self.islandSize = islandSize
+    self.migrationInterval = migrationInterval
+    self.migrantCount = migrantCount
+    self.executor = executor
+    self.encoding = encoding
+    self.evolveArguments = evolveArguments
+    self.islands = [[] for i in range(islandCount)]  # sorted (individual, score) lists
+    self.randomStates = [random.Random("island %d of %r" % (i, seed)).getstate() for i in range(islandCount)]
+    self.destinations = self._destinations(topology, islandCount)
+    self.fingerprinter = Fingerprinter(genome)
+    self.generation = 0
+    self.best = None  # best (individual, score) seen on any island
+    self.history = []  # (generation, best score) after each epoch
+
+  @staticmethod
+  def _destinations(topology, n):
+    if topology == "ring":
+      return [[(i + 1) % n] if n > 1 else [] for i in range(n)]
+    if topology == "complete":
+      return [[j for j in range(n) if j != i] for i in range(n)]
+    if callable(topology):
+      return [list(topology(i, n)) for i in range(n)]
+    if len(topology) != n:
+      raise ValueError("topology lists destinations for %d islands, not %d" % (len(topology), n))
+    return [list(destinations) for destinations in topology]
+
+  def run(self, generations):
+    """Evolve every island for generations more generations; returns the best (individual, score)."""
+    while generations > 0:
+      epoch = min(generations, self.migrationInterval)
+      tasks = [(self.genome, self.scoringFunction, self.encoding, members, state, self.islandSize,
+                epoch, self.evolveArguments) for (members, state) in zip(self.islands, self.randomStates)]
+      results = list((map if self.executor is None else self.executor.map)(_evolveIsland, tasks))
+      self.islands = [members for (members, state) in results]
+      self.randomStates = [state for (members, state) in results]
+      self.generation += epoch
+      generations -= epoch
+      for members in self.islands:
+        if members and (self.best is None or members[-1][1] > self.best[1]):
+          self.best = members[-1]
+      self.history.append((self.generation, self.best[1] if self.best else None))
+      if generations > 0:
+        self.migrate()
+    return self.best
+
+  def migrate(self):
+    """Replace the worst individuals of each island with the best of the islands sending to it."""
+    if self.migrantCount <= 0:
+      return
+    arrivals = [[] for island in self.islands]
+    for (source, destinations) in enumerate(self.destinations):
+      for destination in destinations:
+        arrivals[destination].extend(self.islands[source][-self.migrantCount:])
+    for (i, migrants) in enumerate(arrivals):
+      members = self.islands[i]
+      present = set(self.fingerprinter.fingerprint(individual) for (individual, score) in members)
+      newcomers = []
+      for (individual, score) in migrants:
+        key = self.fingerprinter.fingerprint(individual)
+        if key not in present:
+          present.add(key)
+          newcomers.append((individual, score))
+      newcomers = newcomers[:len(members)]
+      members = members[len(newcomers):] + newcomers
+      members.sort(key=operator.itemgetter(1))
+      self.islands[i] = members
+
 def frange(a, b, step):
   while a < b:
     yield a
@@ -173,9 +1138,9 @@ class FloatGene:
     self.lo = lo
     self.hi = hi
   def roll(self):
-    return random.random * (self.hi-self.lo) + self.lo
+    return self.random.random() * (self.hi-self.lo) + self.lo
   def mutate(self, prior=None):
-    return self.roll
+    return self.roll()
 
 
 class Sequence:
@@ -191,11 +1156,15 @@ class Sequence:
     self.a = a
     self.b = b
     self.length = length
-    self.increment = (b-a)/(length-1)
+    self.increment = (b-a)/(length-1) if length > 1 else 0
   def __len__(self):
     return self.length
   def __getitem__(self, i):
     if type(i) != slice:
+      if i < 0:
+        i += self.length
+      if i < 0 or i >= self.length:
+        raise IndexError("sequence index out of range")
       x = self.a + i * self.increment
       return self.f(x)
     (start, stop, step) = i.indices(self.length)
@@ -222,14 +1191,92 @@ class Sequence:
 #   def __delitem__(self, key):
   def index(self, y):
     x = self.finv(y)
-    i = round((x-self.a) / self.increment)
+    i = round((x-self.a) / self.increment) if self.increment else 0
     if i<0 or i>=self.length:
       raise ValueError
     return i
+  def __contains__(self, y):
+    try:
+      return self[self.index(y)] == y
+    except (ValueError, TypeError):
+      return False
+
+def _identity(x):
+  return x
 
 class LinearSequence(Sequence):
   def __init__(self, a, b, length):
-    super().__init__(lambda x: x, lambda y: y, a, b, length)
+    super().__init__(_identity, _identity, a, b, length)
+
+class FloatRange(LinearSequence):
+  """The floats start, start+step, start+2*step, ... below stop, computed as they are read.
+
+  A lazy replacement for tuple(frange(start, stop, step)): nothing is stored per value,
+  index() is arithmetic, and value i is start + i*step without frange's accumulated
+  rounding.  (For integer genes, range already behaves this way.)
+  """
+  def __init__(self, start, stop, step):
+    length = max(0, math.ceil((stop - start) / step))
+    if length and start + (length - 1) * step >= stop:
+      length -= 1
+    super().__init__(start, start + (length - 1) * step, length)
+    self.stop = stop
+    self.step = step
+    self.increment = step
+  def __repr__(self):
+    return "FloatRange(%r, %r, %r)" % (self.a, self.stop, self.step)
+
+class FakeSimulator:
+  """A local stand-in for a simulator service, for exercising evolveAsync.
+
+  It listens on a free port of 127.0.0.1.  A client sends one line of JSON gene values and
+  reads back one line, demo_score of those genes, after delay seconds; one request in
+  hangFraction (picked from the genes, so the same ones always hang) takes hangDelay.
+  Use it as an async context manager, and score with its score coroutine.
+  """
+  def __init__(self, delay=0.01, hangDelay=10.0, hangFraction=0.05):
+    self.delay = delay
+    self.hangDelay = hangDelay
+    self.hangFraction = hangFraction
+    self.server = None
+    self.port = None
+    self.requests = 0
+
+  async def __aenter__(self):
+    import asyncio
+    self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+    self.port = self.server.sockets[0].getsockname()[1]
+    return self
+
+  async def __aexit__(self, *exc):
+    self.server.close()
+    await self.server.wait_closed()
+
+  async def _handle(self, reader, writer):
+    import asyncio
+    import json
+    try:
+      line = await reader.readline()
+      self.requests += 1
+      hang = random.Random(line).random() < self.hangFraction
+      await asyncio.sleep(self.hangDelay if hang else self.delay)
+      writer.write(b"%r\n" % demo_score(json.loads(line)))
+      await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+      pass
+    finally:
+      writer.close()
+
+  async def score(self, individual):
+    import asyncio
+    import json
+    (reader, writer) = await asyncio.open_connection("127.0.0.1", self.port)
+    try:
+      writer.write(json.dumps(dict(individual), sort_keys=True).encode() + b"\n")
+      await writer.drain()
+      return float(await reader.readline())
+    finally:
+      writer.close()
 
 def demo_score(i):
     """Score an individual by fit to ax^2+bx+c = e^x in the range [0,1]"""
@@ -242,16 +1289,45 @@ def demo_score(i):
       total += (a*x*x+b*x+c-math.exp(x))**2
     return -total # higher scores == more fit individual
 
-def demo_main():
+def demo_batch_score(columns):
+    """demo_score of a whole generation, given columns {"a": [...], "b": [...], "c": [...]}.
+
+    With NumPy the residuals of every individual at every x are one array expression.
+    Without it, the sums over x of the powers of x, of x^n * e^x and of e^2x are worked out
+    once per batch, after which each individual's sum of squares takes a few multiplications.
+    """
+    try:
+      import numpy
+    except ImportError:
+      numpy = None
+    if numpy is not None:
+      x = numpy.arange(100) * 0.01
+      a = numpy.asarray(columns["a"], dtype=float)[:, numpy.newaxis]
+      b = numpy.asarray(columns["b"], dtype=float)[:, numpy.newaxis]
+      c = numpy.asarray(columns["c"], dtype=float)[:, numpy.newaxis]
+      return -(((a*x + b)*x + c - numpy.exp(x))**2).sum(axis=1)
+    xs = [i * 0.01 for i in range(100)]
+    (s0, s1, s2, s3, s4) = [sum(x**n for x in xs) for n in range(5)]
+    (e0, e1, e2) = [sum(x**n * math.exp(x) for x in xs) for n in range(3)]
+    ee = sum(math.exp(2*x) for x in xs)
+    return [-(a*a*s4 + b*b*s2 + c*c*s0 + 2*(a*b*s3 + a*c*s2 + b*c*s1) - 2*(a*e2 + b*e1 + c*e0) + ee)
+            for (a, b, c) in zip(columns["a"], columns["b"], columns["c"])]
+
+def demo_main(executor=None, cache=None, encoded=False, batch=False):
     """Evolve an individual to maximize demo_score."""
     randomizer = random.Random()
     randomizer.seed(0)
     genome = { 
-        "a": tuple(frange(-3,3,0.0001)), 
-        "b": tuple(frange(-3,3,0.0001)), 
-        "c": tuple(frange(-3,3,0.0001))}
+        "a": FloatRange(-3,3,0.0001), 
+        "b": FloatRange(-3,3,0.0001), 
+        "c": FloatRange(-3,3,0.0001)}
 
-    population = Population(genome,demo_score,randomizer)
+    encoding = Encoding(genome) if encoded else None
+    if batch:
+      population = Population(genome,None,randomizer,executor,cache=cache,encoding=encoding,
+                              batchScoringFunction=demo_batch_score,columnar=True)
+    else:
+      population = Population(genome,demo_score,randomizer,executor,cache=cache,encoding=encoding)
     #population.addIndividual({"a":0.8389, "b":0.8515, "c":1.0129})
     population.addRandomIndividuals(100)
     generation=0
@@ -295,6 +1371,634 @@ def demo_sequence():
     
 
 
+def demo_islands(executor=None):
+    """Evolve demo_score on four islands in a ring, migrating every 20 generations."""
+    genome = { key : FloatRange(-3,3,0.0001) for key in "abc" }
+    model = IslandModel(genome, demo_score, islandCount=4, islandSize=50, seed=0, migrationInterval=20,
+                        executor=executor, mutation=0.20, elitism=2)
+    model.run(200)
+    for (generation, score) in model.history:
+      print("gen %.3d: %s" % (generation, score))
+    print("best: %s" % (model.best,))
+
+def demo_steady_state(evaluations=2000, concurrency=16, timeout=0.5):
+    """Evolve demo_score through a FakeSimulator, keeping concurrency evaluations in flight."""
+    import asyncio
+    import time
+    genome = { key : FloatRange(-3,3,0.0001) for key in "abc" }
+
+    async def run():
+      async with FakeSimulator() as simulator:
+        population = Population(genome, simulator.score, random.Random(0))
+        start = time.perf_counter()
+        stats = await population.evolveAsync(evaluations, concurrency, timeout, mutation=0.20,
+                                             populationSize=50)
+        elapsed = time.perf_counter() - start
+        print("%s in %.1f s (%.1f s if scored one at a time)" % (stats, elapsed,
+              stats['scored'] * simulator.delay + stats['timeouts'] * timeout))
+        print("best: %s" % (population.population[-1],))
+    asyncio.run(run())
+
 if __name__=='__main__':
-#     demo_sequence()
-    demo_main()
+  """Unit Testing"""
+  import unittest
+
+  class FitnessCacheTests(unittest.TestCase):
+    def test_lru(self):
+      cache = FitnessCache(maxsize=3)
+      for key in "abc":
+        cache.put(key, ord(key))
+      self.assertEqual(cache.get("a"), ord("a"))
+      cache.put("d", 4)  # evicts b, the least recently used
+      self.assertEqual(sorted(cache.scores), ["a", "c", "d"])
+      self.assertIsNone(cache.get("b"))
+      cache.put("c", 5)  # an update, not an insertion
+      self.assertEqual((len(cache), cache.get("c")), (3, 5))
+      self.assertEqual(cache.info(), {'hits': 2, 'misses': 1, 'evictions': 1, 'size': 3,
+                                      'maxsize': 3, 'policy': "lru"})
+
+    def test_lfu(self):
+      cache = FitnessCache(maxsize=3, policy="lfu")
+      for key in "abc":
+        cache.put(key, ord(key))
+      cache.get("a")
+      cache.get("a")
+      cache.get("c")
+      cache.put("d", 4)  # evicts b, used once
+      self.assertEqual(sorted(cache.scores), ["a", "c", "d"])
+      cache.put("e", 5)  # evicts d, now the least used
+      self.assertEqual(sorted(cache.scores), ["a", "c", "e"])
+      self.assertEqual(cache.frequencies, {"a": 3, "c": 2, "e": 1})
+      self.assertRaises(ValueError, FitnessCache, policy="fifo")
+
+    def test_resize(self):
+      for policy in ("lru", "lfu"):
+        cache = FitnessCache(policy=policy)
+        for i in range(10):
+          cache.put(i, i * i)
+        cache.get(2)
+        cache.resize(4)
+        self.assertEqual(len(cache), 4)
+        self.assertIn(2, cache)
+        self.assertEqual(cache.evictions, 6)
+        cache.resize(0)
+        cache.put(11, 1)
+        self.assertEqual(len(cache), 0)
+        cache.resize(None)
+        cache.put(11, 1)
+        self.assertEqual(cache.get(11), 1)
+
+    def test_saveLoad(self):
+      import tempfile
+      with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "scores")
+        cache = FitnessCache(policy="lfu", path=path)
+        cache.put("a", 1.5)
+        cache.put("b", -2)
+        cache.get("b")
+        cache.save()
+        self.assertEqual(os.listdir(directory), ["scores"])
+        loaded = FitnessCache(policy="lfu", path=path)
+        self.assertEqual(loaded.scores, cache.scores)
+        self.assertEqual(loaded.frequencies, {"a": 1, "b": 2})
+        self.assertEqual(loaded.info()['hits'], 0)
+        other = FitnessCache(maxsize=1)
+        other.load(path)
+        self.assertEqual(list(other.scores.items()), [("b", -2)])
+      self.assertRaises(ValueError, FitnessCache().save)
+
+    def test_population(self):
+      genome = { key : tuple(range(10)) for key in "xyz" }
+      calls = []
+      def score(individual):
+        calls.append(1)
+        return sum(individual.values())
+      cache = FitnessCache()
+      population = Population(genome, score, random.Random(1), cache=cache)
+      population.addRandomIndividuals(20)
+      individual = population.population[0][0]
+      self.assertEqual(population.scoreAll([dict(individual)] * 3)[2][1], sum(individual.values()))
+      self.assertEqual(len(calls), 20)
+      for generation in range(5):  # @UnusedVariable
+        population.evolve(elitism=2, mutation=0.2)
+      self.assertEqual(len(calls), len(cache))
+
+  class ExecutorTests(unittest.TestCase):
+    genome = { key : FloatRange(-3,3,0.0001) for key in "abc" }
+
+    def evolve(self, executor, encoding=None):
+      population = Population(self.genome, demo_score, random.Random(16), executor, chunkSize=4,
+                              encoding=encoding)
+      population.addRandomIndividuals(30)
+      for generation in range(5):  # @UnusedVariable
+        population.evolve(elitism=2, mutation=0.2)
+      return [(dict(individual), score) for (individual, score) in population.population]
+
+    def test_executors(self):
+      self.assertIsNone(createExecutor("serial"))
+      self.assertRaises(ValueError, createExecutor, "cluster")
+      for encoding in (None, Encoding(self.genome)):
+        serial = self.evolve(None, encoding)
+        self.assertEqual(len(serial), 30)
+        for kind in ("thread", "process"):
+          executor = createExecutor(kind, 2)
+          try:
+            self.assertEqual(self.evolve(executor, encoding), serial)
+          finally:
+            executor.shutdown()
+
+  class BatchScoringTests(unittest.TestCase):
+    genome = { key : FloatRange(-3,3,0.0001) for key in "abc" }
+
+    @staticmethod
+    def rows(individuals):
+      return [demo_score(individual) for individual in individuals]
+
+    @staticmethod
+    def columns(columns):
+      return [demo_score({"a": a, "b": b, "c": c})
+              for (a, b, c) in zip(columns["a"], columns["b"], columns["c"])]
+
+    def evolve(self, cache=None, encoding=None, **kwargs):
+      scoringFunction = None if kwargs else demo_score
+      population = Population(self.genome, scoringFunction, random.Random(17), cache=cache,
+                              encoding=encoding, **kwargs)
+      population.addRandomIndividuals(30)
+      for generation in range(5):  # @UnusedVariable
+        population.evolve(elitism=2, mutation=0.2)
+      return [(dict(individual), score) for (individual, score) in population.population]
+
+    def test_batches(self):
+      for encoding in (None, Encoding(self.genome)):
+        single = self.evolve(encoding=encoding)
+        self.assertEqual(self.evolve(encoding=encoding, batchScoringFunction=self.rows), single)
+        self.assertEqual(self.evolve(encoding=encoding, batchScoringFunction=self.columns, columnar=True),
+                         single)
+        cache = FitnessCache()
+        self.assertEqual(self.evolve(cache, encoding, batchScoringFunction=self.columns, columnar=True),
+                         single)
+        self.assertEqual(cache.misses, len(cache))
+        # a second run breeds the same individuals, and scores none of them again
+        scored = []
+        def counted(individuals):
+          scored.extend(individuals)
+          return self.rows(individuals)
+        self.assertEqual(self.evolve(cache, encoding, batchScoringFunction=counted), single)
+        self.assertEqual((scored, cache.misses), ([], len(cache)))
+
+    def test_wrongCount(self):
+      population = Population(self.genome, None, random.Random(18),
+                              batchScoringFunction=lambda individuals: [0] * (len(individuals) + 1))
+      self.assertRaises(ValueError, population.addRandomIndividuals, 5)
+      self.assertRaises(ValueError, Population, self.genome, None)
+      one = Population(self.genome, None, batchScoringFunction=self.rows)
+      individual = roll(self.genome, random.Random(19))
+      self.assertEqual(one.score(individual), (individual, demo_score(individual)))
+
+    def test_demoBatchScore(self):
+      r = random.Random(20)
+      individuals = [roll(self.genome, r) for i in range(50)]  # @UnusedVariable
+      columns = { key : [individual[key] for individual in individuals] for key in "abc" }
+      for (batch, single) in zip(demo_batch_score(columns), map(demo_score, individuals)):
+        self.assertAlmostEqual(batch, single, delta=1e-9 * max(1, abs(single)))
+
+  class GeneTests(unittest.TestCase):
+    def test_floatRange(self):
+      for (start, stop, step) in ((-3, 3, 0.0001), (0, 1, 0.1), (0.5, 0.75, 0.25), (2, 1, 0.5), (0, 1, 0.3)):
+        values = tuple(frange(start, stop, step))
+        genes = FloatRange(start, stop, step)
+        self.assertEqual(len(genes), max(0, math.ceil(round((stop - start) / step, 9))))
+        self.assertLessEqual(abs(len(genes) - len(values)), 1)
+        for i in range(0, len(genes), max(1, len(genes) // 97)):
+          self.assertAlmostEqual(genes[i], start + i * step)
+          self.assertEqual(genes.index(genes[i]), i)
+          self.assertIn(genes[i], genes)
+        if len(genes):
+          self.assertLess(genes[-1], stop)
+      genes = FloatRange(0, 1, 0.1)
+      self.assertEqual(len(genes), 10)
+      self.assertEqual(genes.index(0.30000000000000004), 3)
+      self.assertNotIn(0.35, genes)
+      self.assertNotIn("a", genes)
+      self.assertRaises(ValueError, genes.index, 1.5)
+      self.assertEqual(repr(genes), "FloatRange(0, 1, 0.1)")
+
+    def test_sequence(self):
+      squares = Sequence(lambda x: x * x, math.sqrt, 0, 10, 11)
+      self.assertEqual(list(squares), [i * i for i in range(11)])
+      self.assertEqual((squares[-1], squares[-11]), (100, 0))
+      self.assertRaises(IndexError, squares.__getitem__, 11)
+      self.assertRaises(IndexError, squares.__getitem__, -12)
+      self.assertEqual(list(squares[2:8:3]), [4, 25])
+      self.assertEqual(list(squares[8:2:-3]), [64, 25])
+      self.assertEqual(squares[5:5], [])
+      self.assertEqual(squares.index(49), 7)
+      self.assertEqual(squares.index(50), 7)  # the closest
+      self.assertIn(49, squares)
+      self.assertNotIn(50, squares)
+      single = LinearSequence(4, 4, 1)
+      self.assertEqual((list(single), single.index(4), 4 in single, 5 in single), ([4], 0, True, False))
+      self.assertRaises(ValueError, LinearSequence(0, 1, 2).index, 3)
+
+    def test_geneIndex(self):
+      global _reverseIndexLimit, _reverseIndexSize
+      genes = [tuple("%s%d" % (name, i) for i in range(100)) for name in "abcde"]
+      saved = (_reverseIndexLimit, _reverseIndexSize, list(_reverseIndexes.items()))
+      _reverseIndexes.clear()
+      (_reverseIndexLimit, _reverseIndexSize) = (300, 0)
+      try:
+        for gene in genes:
+          self.assertEqual(geneIndex(gene, gene[37]), 37)
+        # only the last three tuples fit in 300 values
+        self.assertEqual(list(_reverseIndexes), [id(gene) for gene in genes[2:]])
+        self.assertEqual(geneIndex(genes[2], "c99"), 99)
+        self.assertEqual(list(_reverseIndexes), [id(gene) for gene in genes[3:] + genes[2:3]])
+        self.assertEqual(geneIndex(genes[0], "a5"), 5)
+        self.assertNotIn(id(genes[3]), _reverseIndexes)
+        self.assertLessEqual(sum(len(gene) for (gene, reverse) in _reverseIndexes.values()), 300)
+        self.assertEqual(geneIndex(range(5, 50, 5), 20), 3)
+        self.assertEqual(geneIndex(([1], [2]), [2]), 1)
+        self.assertRaises(ValueError, geneIndex, genes[0], "z")
+      finally:
+        (_reverseIndexLimit, _reverseIndexSize) = saved[:2]
+        _reverseIndexes.clear()
+        _reverseIndexes.update(saved[2])
+
+    def test_floatGene(self):
+      gene = FloatGene(-2, 3, random.Random(21))
+      expected = random.Random(21)
+      for i in range(20):  # @UnusedVariable
+        value = gene.roll()
+        self.assertEqual(type(value), float)
+        self.assertEqual(value, expected.random() * 5 - 2)
+        mutated = gene.mutate(value)
+        self.assertEqual(mutated, expected.random() * 5 - 2)
+        self.assertTrue(-2 <= mutated < 3)
+      self.assertEqual(Gene(random.Random(22)).roll(), random.Random(22).random())
+
+  class EncodingTests(unittest.TestCase):
+    genome = {"colour": ("red", "green", "blue"), "size": tuple(range(1000)), "x": FloatRange(0, 1, 0.001)}
+
+    def test_encode(self):
+      encoding = Encoding(self.genome)
+      individual = {"colour": "blue", "size": 17, "x": 0.5}
+      row = encoding.encode(individual)
+      self.assertEqual(list(row), [2, 17, 500])
+      self.assertEqual(encoding.decode(row), individual)
+      self.assertRaises(TypeError, Encoding, {"x": FloatGene(0, 1)})
+      r = random.Random(2)
+      rows = [encoding.roll(r) for i in range(3000)]  # @UnusedVariable
+      self.assertTrue(all(v < n for row in rows for (v, n) in zip(row, encoding.sizes)))
+      self.assertEqual(collections.Counter(row[0] for row in rows).keys(), {0, 1, 2})
+      self.assertAlmostEqual(sum(row[1] for row in rows) / len(rows), 499.5, delta=20)
+      self.assertEqual(encoding.roll(random.Random(2)), rows[0])
+
+    def test_cross(self):
+      encoding = Encoding({key : range(1 << 32) for key in range(40)})
+      ones = array('I', [0xFFFFFFFF] * 40)
+      zeros = array('I', [0] * 40)
+      r = random.Random(3)
+      fromOnes = [0] * 40
+      for i in range(500):  # @UnusedVariable
+        child = encoding.cross(ones, zeros, r)
+        # every field comes whole from one parent, so no mask bit spills into a neighbour
+        self.assertTrue(set(child) <= {0, 0xFFFFFFFF})
+        for (j, v) in enumerate(child):
+          fromOnes[j] += v != 0
+      self.assertTrue(all(200 < n < 300 for n in fromOnes))
+      a = array('I', range(40))
+      b = array('I', range(100, 140))
+      child = encoding.cross(a, b, r)
+      self.assertTrue(all(v in (i, i + 100) for (i, v) in enumerate(child)))
+      self.assertEqual(Encoding({}).cross(array('I'), array('I')), array('I'))
+
+    def test_mutate(self):
+      encoding = Encoding({key : range(1000) for key in range(1000)})
+      r = random.Random(4)
+      row = encoding.roll(r)
+      same = encoding.mutate(row, 0, r)
+      self.assertEqual(same, row)
+      self.assertIsNot(same, row)
+      changes = []
+      for i in range(20):  # @UnusedVariable
+        mutated = encoding.mutate(row, 0.1, r)
+        self.assertTrue(all(v < 1000 for v in mutated))
+        changes.append(sum(x != y for (x, y) in zip(row, mutated)))
+      self.assertAlmostEqual(sum(changes) / len(changes), 100, delta=15)
+      self.assertGreater(sum(x != y for (x, y) in zip(row, encoding.mutate(row, 1, r))), 990)
+
+    def test_genotypes(self):
+      import pickle
+      encoding = Encoding(self.genome)
+      genotypes = GenotypeArray.rolled(encoding, 5, random.Random(5))
+      view = genotypes.append({"colour": "red", "size": 3, "x": 0.25})
+      self.assertEqual((len(genotypes), view.rowIndex), (6, 5))
+      self.assertEqual(dict(view), {"colour": "red", "size": 3, "x": 0.25})
+      self.assertEqual(genotypes[-1], view)
+      self.assertEqual(view, {"colour": "red", "size": 3, "x": 0.25})
+      self.assertEqual(encoding.encode(view), array('I', [0, 3, 250]))
+      self.assertRaises(IndexError, genotypes.__getitem__, 6)
+      self.assertRaises(ValueError, genotypes.append, array('I', [0]))
+      copy = pickle.loads(pickle.dumps(view))
+      self.assertEqual(type(copy), dict)
+      self.assertEqual(copy, dict(view))
+      self.assertEqual(genotypes.toList()[5], copy)
+
+  class FingerprintTests(unittest.TestCase):
+    def test_fingerprint(self):
+      fingerprinter = Fingerprinter({"a": (), "b": ()})
+      f = fingerprinter.fingerprint
+      self.assertEqual(f({"a": 1, "b": "x"}), f({"b": "x", "a": 1}))
+      self.assertNotEqual(f({"a": 1, "b": "x"}), f({"a": "x", "b": 1}))
+      self.assertEqual(f({"a": 1, "b": (2, [3])}), f({"a": 1.0, "b": (2.0, [True + 2])}))
+      self.assertEqual(f({"a": True, "b": 0.0}), f({"a": 1, "b": -0.0}))
+      self.assertNotEqual(f({"a": 1, "b": 0.5}), f({"a": 1, "b": "0.5"}))
+      self.assertNotEqual(f({"a": (1,), "b": 0}), f({"a": [1], "b": 0}))
+      self.assertNotEqual(f({"a": 1, "b": 2}), f({"a": 1, "b": 2, "c": 3}))
+      self.assertEqual(f({"a": 1, "b": 2, "c": 3}), f({"c": 3, "b": 2.0, "a": 1}))
+      self.assertLess(f({"a": 1, "b": 2}), 1 << 64)
+      wide = Fingerprinter(bits=128).fingerprint
+      self.assertEqual(wide({"a": 1, "b": 2}), wide({"b": 2, "a": 1.0}))
+      self.assertGreater(max(wide({"a": i, "b": 2}) for i in range(10)), 1 << 64)
+      self.assertRaises(ValueError, Fingerprinter, bits=32)
+
+    def test_stable(self):
+      import pickle
+      import subprocess
+      fingerprinter = Fingerprinter({"a": (), "b": ()})
+      copy = pickle.loads(pickle.dumps(fingerprinter))
+      self.assertEqual(copy.keys, ["a", "b"])
+      individuals = [{"a": 0.25, "b": -3}, {"a": "x", "b": b"y"}, {"a": (1, "z"), "b": None},
+                     {"a": frozenset({2}), "b": 1.5}, {"a": 1, "b": 2, "c": 3}]
+      fingerprints = [fingerprinter.fingerprint(individual) for individual in individuals]
+      self.assertEqual([copy.fingerprint(individual) for individual in individuals], fingerprints)
+      self.assertEqual(len(set(fingerprints)), len(fingerprints))
+      # the same in another process, whose str hashes are salted differently
+      script = ("import sys; sys.path.insert(0, %r); import genetics; f = genetics.Fingerprinter(%r)\n"
+                "print([f.fingerprint(i) for i in %r])"
+                % (os.path.dirname(os.path.abspath(__file__)), ["a", "b"], individuals))
+      output = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, check=True,
+                              env=dict(os.environ, PYTHONHASHSEED="random")).stdout
+      self.assertEqual(output.decode().strip(), repr(fingerprints))
+      self.assertRaises(TypeError, fingerprinter.fingerprint, {"a": lambda: 0, "b": 1})
+
+    def test_individual(self):
+      import pickle
+      fingerprinter = Fingerprinter()
+      individual = Individual(a=1, b=2)
+      first = fingerprinter.fingerprint(individual)
+      self.assertEqual(individual.fingerprint, first)
+      self.assertEqual(fingerprinter.fingerprint(individual), first)
+      changes = [lambda i: i.__setitem__("a", 3), lambda i: i.update(b=4), lambda i: i.pop("a"),
+                 lambda i: i.setdefault("c", 5), lambda i: i.__delitem__("b"), lambda i: i.popitem(),
+                 lambda i: i.clear(), lambda i: i.__ior__({"a": 6})]
+      for change in changes:
+        individual = Individual(a=1, b=2)
+        fingerprinter.fingerprint(individual)
+        change(individual)
+        self.assertIsNone(individual.fingerprint)
+        self.assertEqual(fingerprinter.fingerprint(individual), fingerprinter.fingerprint(dict(individual)))
+      individual = Individual(a=1, b=2)
+      fingerprinter.fingerprint(individual)
+      # a fingerprint made by another fingerprinter is not reused
+      other = Fingerprinter(bits=128)
+      self.assertEqual(other.fingerprint(individual), other.fingerprint(dict(individual)))
+      self.assertIs(individual.fingerprinter, other)
+      self.assertIsNone(individual.copy().fingerprint)
+      copy = pickle.loads(pickle.dumps(individual))
+      self.assertEqual((type(copy), copy, copy.fingerprint), (Individual, individual, None))
+
+    def test_duplicates(self):
+      genome = {"a": (0, 1, 2), "b": (0.0, 0.5, 1.0)}
+      for exactCompare in (False, True):
+        population = Population(genome, lambda i: i["a"] + i["b"], exactCompare=exactCompare)
+        population.addIndividual({"a": 1, "b": 0.0})
+        self.assertIn({"a": 1.0, "b": -0.0}, population)
+        self.assertIn(Individual(b=0, a=True), population)
+        self.assertNotIn({"a": 1, "b": 0.5}, population)
+
+  class SelectionTests(unittest.TestCase):
+    population = [({"x": i}, score) for (i, score) in enumerate((-4, 0, 1, 3))]
+
+    def frequencies(self, selection, draws=20000, seed=6):
+      r = random.Random(seed)
+      counts = collections.Counter(selection.select(r)["x"] for i in range(draws))  # @UnusedVariable
+      return [counts[i] / draws for i in range(len(self.population))]
+
+    def assertFrequencies(self, selection, expected):
+      for (f, e) in zip(self.frequencies(selection), expected):
+        self.assertAlmostEqual(f, e, delta=0.015)
+
+    def test_prepare(self):
+      self.assertRaises(TypeError, Selection)
+      selection = RankRoulette().prepare(self.population, 2)
+      self.assertIs(selection.pool, self.population)
+      self.assertEqual((selection.start, selection.poolSize), (2, 2))
+      self.assertEqual(RankRoulette().prepare(self.population, 10).poolSize, 4)
+      self.assertEqual(RankRoulette().prepare(self.population).poolSize, 4)
+      (a, b) = selection.pair(random.Random(7))
+      self.assertNotEqual(a, b)
+      self.assertEqual({a["x"], b["x"]}, {2, 3})
+
+    def test_pairs(self):
+      for selection in (RankRoulette(), Tournament(), FitnessProportional()):
+        selection.prepare(self.population, 3)
+        pairs = selection.pairs(500, random.Random(8))
+        self.assertEqual(len(pairs), 500)
+        self.assertTrue(all(a != b and a["x"] > 0 and b["x"] > 0 for (a, b) in pairs))
+        r = random.Random(8)
+        self.assertEqual(pairs, [selection.pair(r) for i in range(500)])  # @UnusedVariable
+        self.assertEqual(selection.pairs(0), [])
+
+    def test_rankRoulette(self):
+      # index i of n is drawn for i*(i-1)/2 < v <= i*(i+1)/2, v uniform in 0...n*(n-1)/2
+      self.assertFrequencies(RankRoulette().prepare(self.population), [1/7, 1/7, 2/7, 3/7])
+      self.assertFrequencies(RankRoulette().prepare(self.population, 2), [0, 0, 1/2, 1/2])
+
+    def test_tournament(self):
+      # the best of two uniform draws is index i with probability (2i+1)/n^2
+      self.assertFrequencies(Tournament().prepare(self.population), [1/16, 3/16, 5/16, 7/16])
+      self.assertFrequencies(Tournament(1).prepare(self.population), [1/4] * 4)
+      self.assertFrequencies(Tournament(3).prepare(self.population, 3), [0, 1/27, 7/27, 19/27])
+
+    def test_fitnessProportional(self):
+      self.assertFrequencies(FitnessProportional().prepare(self.population), [0, 4/16, 5/16, 7/16])
+      self.assertFrequencies(FitnessProportional().prepare(self.population, 2), [0, 0, 0, 1])
+      self.assertFrequencies(FitnessProportional(lambda score: 2 ** score).prepare(self.population),
+                             [2 ** s / 11.0625 for s in (-4, 0, 1, 3)])
+      flat = [({"x": i}, 5) for i in range(4)]
+      selection = FitnessProportional().prepare(flat)
+      self.assertEqual(selection.total, 0)
+      self.assertFrequencies(selection, [1/4] * 4)
+
+    def test_evolve(self):
+      genome = { key : tuple(range(20)) for key in "xyz" }
+      for selection in (RankRoulette(), Tournament(3), FitnessProportional()):
+        population = Population(genome, lambda i: -sum((v - 10) ** 2 for v in i.values()), random.Random(8))
+        population.addRandomIndividuals(30)
+        for generation in range(15):  # @UnusedVariable
+          population.evolve(elitism=2, mutation=0.2, maxParents=15, selection=selection)
+        population.sort()
+        self.assertEqual(len(population), 30)
+        self.assertGreater(population.population[-1][1], -3)
+
+  class IslandTests(unittest.TestCase):
+    genome = { key : FloatRange(-3,3,0.0001) for key in "abc" }
+
+    def model(self, executor=None, **kwargs):
+      return IslandModel(self.genome, demo_score, islandCount=3, islandSize=20, seed=1,
+                         migrationInterval=5, executor=executor, mutation=0.2, elitism=2, **kwargs)
+
+    def test_executors(self):
+      serial = self.model()
+      serial.run(15)
+      executor = createExecutor("process", 2)
+      try:
+        parallel = self.model(executor)
+        parallel.run(15)
+      finally:
+        executor.shutdown()
+      self.assertEqual(parallel.islands, serial.islands)
+      self.assertEqual(parallel.history, serial.history)
+      self.assertEqual(parallel.best, serial.best)
+      self.assertEqual([generation for (generation, score) in serial.history], [5, 10, 15])
+      self.assertTrue(all(len(members) == 20 for members in serial.islands))
+      scores = [score for (generation, score) in serial.history]
+      self.assertEqual(scores, sorted(scores))
+
+    def test_migrate(self):
+      model = self.model(topology="ring", migrantCount=3)
+      model.run(5)
+      bests = [members[-3:] for members in model.islands]
+      model.migrate()
+      for (i, members) in enumerate(model.islands):
+        self.assertEqual(len(members), 20)
+        self.assertEqual(members, sorted(members, key=operator.itemgetter(1)))
+        arrivals = [dict(individual) for (individual, score) in bests[i - 1]]
+        self.assertTrue(all(individual in [dict(m) for (m, s) in members] for individual in arrivals))
+      self.assertEqual(IslandModel._destinations("complete", 3), [[1, 2], [0, 2], [0, 1]])
+      self.assertEqual(IslandModel._destinations(lambda i, n: [0], 2), [[0], [0]])
+      self.assertRaises(ValueError, IslandModel._destinations, [[1], [0]], 3)
+
+    def test_evolveSorts(self):
+      population = Population(self.genome, demo_score, random.Random(9))
+      population.addRandomIndividuals(40)
+      for generation in range(3):  # @UnusedVariable
+        population.evolve(elitism=3, mutation=0.2)
+        self.assertTrue(population.isSorted)
+        self.assertEqual(population.population, sorted(population.population, key=operator.itemgetter(1)))
+      self.assertEqual(len(population), 40)
+
+  class SteadyStateTests(unittest.TestCase):
+    genome = { key : FloatRange(-3,3,0.0001) for key in "abc" }
+
+    class Scorer:
+      """A coroutine scoring function counting its calls, that never answers for hung genes."""
+      def __init__(self, hang=lambda individual: False):
+        self.hang = hang
+        self.calls = 0
+        self.hangs = 0
+        self.running = 0
+
+      async def __call__(self, individual):
+        import asyncio
+        self.calls += 1
+        self.running += 1
+        try:
+          if self.hang(individual):
+            self.hangs += 1
+            await asyncio.Event().wait()
+          await asyncio.sleep(0)
+          return demo_score(individual)
+        finally:
+          self.running -= 1
+
+    def evolve(self, population, evaluations, **kwargs):
+      stats = population.evolveSteadyState(evaluations, mutation=0.2, **kwargs)
+      self.assertEqual(stats['bred'], evaluations)
+      self.assertEqual(stats['scored'] + stats['timeouts'] + stats['cached'], evaluations)
+      self.assertEqual(population.population, sorted(population.population, key=operator.itemgetter(1)))
+      self.assertEqual(population.individuals, set(population.hash(i) for (i, s) in population.population))
+      return stats
+
+    def test_populationSize(self):
+      for encoding in (None, Encoding(self.genome)):
+        scorer = self.Scorer()
+        population = Population(self.genome, scorer, random.Random(10), encoding=encoding)
+        stats = self.evolve(population, 500, concurrency=8, populationSize=20)
+        self.assertEqual(len(population), 20)
+        self.assertEqual((stats['scored'], scorer.calls, scorer.running), (500, 500, 0))
+        if encoding is not None:
+          # evicted rows are reused, so the array holds just the population
+          self.assertEqual(len(population.genotypes), 20)
+          self.assertEqual(sorted(v.rowIndex for (v, s) in population.population), list(range(20)))
+          self.assertTrue(all(demo_score(v) == s for (v, s) in population.population))
+      population = Population(self.genome, demo_score, random.Random(11))
+      population.addRandomIndividuals(10)
+      self.evolve(population, 50, concurrency=4)
+      self.assertEqual(len(population), 10)
+      self.assertRaises(ValueError, Population(self.genome, demo_score).evolveSteadyState, 10)
+
+    def test_timeouts(self):
+      scorer = self.Scorer(lambda individual: individual["a"] < -2)
+      population = Population(self.genome, scorer, random.Random(12))
+      stats = self.evolve(population, 300, concurrency=16, timeout=0.01, populationSize=30)
+      self.assertGreater(scorer.hangs, 0)
+      self.assertEqual(stats['timeouts'], scorer.hangs)
+      self.assertEqual(stats['scored'], scorer.calls - scorer.hangs)
+      self.assertEqual(scorer.running, 0)
+      self.assertTrue(all(i["a"] >= -2 for (i, s) in population.population))
+
+    def test_cancel(self):
+      import asyncio
+      scorer = self.Scorer(lambda individual: individual["b"] < 0)
+
+      async def run():
+        population = Population(self.genome, scorer, random.Random(13))
+        task = asyncio.ensure_future(population.evolveAsync(10000, concurrency=8, populationSize=20))
+        while scorer.hangs < 8:
+          await asyncio.sleep(0)
+        self.assertEqual(scorer.running, 8)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+          await task
+        self.assertEqual(scorer.running, 0)
+        self.assertEqual([t for t in asyncio.all_tasks() if t is not asyncio.current_task()], [])
+      asyncio.run(run())
+
+    def test_cache(self):
+      for encoding in (None, Encoding(self.genome)):
+        cache = FitnessCache()
+        scorer = self.Scorer()
+        first = Population(self.genome, scorer, random.Random(14), cache=cache, encoding=encoding)
+        firstStats = self.evolve(first, 200, concurrency=1, populationSize=20)
+        # evicted individuals are bred again, and then found in the cache
+        self.assertGreater(firstStats['cached'], 0)
+        self.assertEqual((scorer.calls, len(cache)), (firstStats['scored'], firstStats['scored']))
+        # the same run again breeds the same children, and finds every one in the cache
+        second = Population(self.genome, scorer, random.Random(14), cache=cache, encoding=encoding)
+        stats = self.evolve(second, 200, concurrency=1, populationSize=20)
+        self.assertEqual(stats, {'bred': 200, 'scored': 0, 'cached': 200, 'timeouts': 0})
+        self.assertEqual(scorer.calls, len(cache))
+        self.assertEqual([s for (i, s) in second.population], [s for (i, s) in first.population])
+        self.assertEqual(cache.info()['hits'], 200 + firstStats['cached'])
+
+    def test_fakeSimulator(self):
+      import asyncio
+
+      async def run():
+        async with FakeSimulator(delay=0, hangDelay=0.5, hangFraction=0.1) as simulator:
+          population = Population(self.genome, simulator.score, random.Random(15))
+          stats = await population.evolveAsync(200, 16, 0.05, mutation=0.2, populationSize=20)
+          self.assertEqual(len(population), 20)
+          self.assertEqual(stats['scored'] + stats['timeouts'], 200)
+          self.assertGreater(stats['timeouts'], 0)
+          self.assertEqual(simulator.requests, 200)
+      asyncio.run(run())
+
+  if __name__ == '__main__':
+    if sys.argv[1:] == ["demo"]:
+      # demo_sequence()
+      demo_main()
+    else:
+      unittest.main()